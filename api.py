@@ -1,20 +1,203 @@
 from collections import Counter
-from typing import List, Dict, Optional
+from functools import partial, wraps
+from typing import List, Dict, Optional, Callable, Tuple, Any
+import hashlib
+import json
+import sqlite3
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import logging
 from dotenv import load_dotenv
 import pycountry
 
+from dbdriver import cache_get, cache_set, API_CACHE_RETENTION
+
 load_dotenv()
 API_KEY: Optional[str] = os.getenv('API_KEY')
 if API_KEY is None:
     raise Exception("API_KEY not found in .env file. Please re-configure")
 
+# Shared session so every IsThereAnyDeal call reuses pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    # ITAD lookups are read-only, so POSTs are as safe to retry as GETs
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset({"GET", "POST"}))
+))
+# Bodies are serialized once with json.dumps and sent as data=, so the content type is set up front
+JSON_HEADERS: Dict[str, str] = {"Content-Type": "application/json"}
+_SESSION.headers.update(JSON_HEADERS)
+_SESSION.params = {"key": API_KEY}
+
+# The prices endpoint takes a list of IDs, requests for more IDs than it accepts are split into batches
+PRICES_URL: str = "https://api.isthereanydeal.com/games/prices/v3"
+PRICES_BATCH_SIZE: int = 200
+
+# Price lookups are cached in-process for a few minutes, keyed by the call arguments
+PRICE_CACHE_TTL: int = 300
+PRICE_CACHE_MAXSIZE: int = 2048
+_price_cache: Dict[Tuple, Tuple[float, Any]] = {}
+# Lookups run in worker threads, so eviction and insertion happen under a lock
+_price_cache_lock = threading.Lock()
+
+# Responses are also kept in the database so they survive restarts, titles map to IDs for good
+GAME_ID_RESPONSE_TTL: int = 86400
+GAME_INFO_RESPONSE_TTL: int = 600
+PRICE_RESPONSE_TTL: int = 300
+# Expired responses are served while a refresh runs in the background, or for much longer if the API is down
+STALE_WHILE_REVALIDATE: int = 60
+STALE_IF_ERROR: int = API_CACHE_RETENTION
+_refreshing: set = set()
+_refreshing_lock = threading.Lock()
+
+# Every ISO 3166-1 alpha-2 code, so country validation is a set lookup
+_ISO2_COUNTRY_CODES = frozenset(country.alpha_2 for country in pycountry.countries)
+
+# Title to ID mappings rarely change, so they are remembered for a day, names without a match included
+GAME_ID_CACHE_TTL: int = 86400
+GAME_ID_CACHE_MAXSIZE: int = 4096
+_game_ids: Dict[str, Tuple[float, Optional[str]]] = {}
+# Lookups run in worker threads, so eviction and insertion happen under a lock
+_game_ids_lock = threading.Lock()
+
+
+def _ttl_cached(func: Callable) -> Callable:
+    """
+    Caches the result of a price lookup in `_price_cache` for PRICE_CACHE_TTL seconds.
+    Exceptions are not cached, so a failed lookup is retried on the next call.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        hit = _price_cache.get(key)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+        value = func(*args, **kwargs)
+        with _price_cache_lock:
+            if key not in _price_cache and len(_price_cache) >= PRICE_CACHE_MAXSIZE:
+                # Evict the oldest entry, dicts keep insertion order
+                del _price_cache[next(iter(_price_cache))]
+            _price_cache[key] = (now + PRICE_CACHE_TTL, value)
+        return value
+
+    return wrapper
+
+
+def clear_price_cache() -> None:
+    """
+    Drops every cached price lookup so the next call goes to the API.
+    """
+    with _price_cache_lock:
+        _price_cache.clear()
+
+
+def _fetch_json(method: str, url: str, params: Dict[str, str], data: Optional[str], ttl: int, cache_key: str,
+                description: str) -> Any:
+    """
+    Sends a request to the IsThereAnyDeal API, stores the response in the persistent cache and returns it decoded.
+    """
+    response = _SESSION.request(method, url, params=params, data=data)
+
+    # Check if the request was successful
+    if response.status_code != 200:
+        raise Exception(f"{description} failed with status code {response.status_code}: {response.text}")
+
+    try:
+        cache_set(cache_key, response.text, ttl)
+    except sqlite3.Error as e:
+        logging.warning("Could not write the API cache: %s", e)
+    return json.loads(response.content)
+
+
+def _refresh_in_background(cache_key: str, description: str, fetch: Callable[[], Any]) -> None:
+    """
+    Runs `fetch` on a daemon thread to update the stale cache entry `cache_key`, unless a refresh of it is
+    already running.
+    """
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def refresh():
+        try:
+            fetch()
+        except Exception as e:
+            logging.warning("Background refresh of %s failed: %s", description, e)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
 
-def get_game_id(game_name: str) -> Dict[str, Optional[str]]:
+def response_cache_key(method: str, url: str, params: Dict[str, str], data: Optional[str]) -> str:
+    """
+    Returns the key a response is stored under in the persistent cache, the same for every client of the API.
+    """
+    return hashlib.sha256(f"{method} {url} {json.dumps(params, sort_keys=True)} {data}".encode()).hexdigest()
+
+
+def _request_json(method: str, url: str, params: Dict[str, str], body: Optional[List[str]], ttl: int,
+                  description: str = "API request") -> Any:
+    """
+    Sends a request to the IsThereAnyDeal API and returns the decoded JSON response. Successful
+    responses are stored in the persistent cache for `ttl` seconds, keyed by URL, params and body.
+
+    A response that expired less than STALE_WHILE_REVALIDATE seconds ago is returned right away while it is
+    refreshed in the background. If the API can't be reached, responses up to STALE_IF_ERROR seconds past
+    their expiry are returned instead of raising.
+
+    Args:
+        method (str): 'GET' or 'POST'.
+        url (str): The endpoint to call.
+        params (Dict[str, str]): Query parameters, the API key comes from the session.
+        body (Optional[List[str]]): The JSON body to send, or None for no body.
+        ttl (int): How many seconds a response stays cached.
+        description (str): Names the request in the error raised when it fails.
+
+    Returns:
+        Any: The parsed JSON body.
+    """
+    data = json.dumps(body) if body is not None else None
+    cache_key = response_cache_key(method, url, params, data)
+    try:
+        cached = cache_get(cache_key, max_stale=STALE_IF_ERROR)
+    except sqlite3.Error as e:
+        logging.warning("Could not read the API cache: %s", e)
+        cached = None
+
+    fetch = partial(_fetch_json, method, url, params, data, ttl, cache_key, description)
+    if cached is not None:
+        value, expires_at = cached
+        age = time.time() - expires_at
+        if age <= 0:
+            return json.loads(value)
+        if age <= STALE_WHILE_REVALIDATE:
+            _refresh_in_background(cache_key, description, fetch)
+            return json.loads(value)
+
+    try:
+        return fetch()
+    except requests.RequestException as e:
+        if cached is None:
+            raise
+        logging.warning("%s failed, serving a cached response instead: %s", description, e)
+        return json.loads(cached[0])
+
+
+def get_game_ids(game_names: List[str]) -> Dict[str, Optional[str]]:
     """
     Given a list of game names, returns a dictionary with game names and their corresponding IDs.
+    Names looked up within the last GAME_ID_CACHE_TTL seconds are answered from memory, the rest are sent in a
+    single request.
 
     Args:
         game_names (List[str]): List of game titles as strings.
@@ -24,190 +207,178 @@ def get_game_id(game_name: str) -> Dict[str, Optional[str]]:
     """
     url: str = "https://api.isthereanydeal.com/lookup/id/title/v1"
 
-    headers: Dict[str, str] = {
-        'Content-Type': 'application/json'
-    }
-    params: Dict[str, str] = {
-        'key': API_KEY
-    }
+    now = time.monotonic()
+    ids: Dict[str, Optional[str]] = {}
+    for name in dict.fromkeys(game_names):
+        entry = _game_ids.get(name)
+        if entry is not None and entry[0] > now:
+            ids[name] = entry[1]
 
     # The body needs to be a JSON array of game names
-    body = [game_name]
+    body = [name for name in dict.fromkeys(game_names) if name not in ids]
 
-    # Send POST request
-    response = requests.post(url, params=params, json=body, headers=headers)
+    if body:
+        # Send POST request
+        data = _request_json("POST", url, {}, body, GAME_ID_RESPONSE_TTL, "API to get Game IDs request")
+        with _game_ids_lock:
+            for name in body:
+                ids[name] = data.get(name)
+                _game_ids.pop(name, None)
+                if len(_game_ids) >= GAME_ID_CACHE_MAXSIZE:
+                    del _game_ids[next(iter(_game_ids))]
+                _game_ids[name] = (now + GAME_ID_CACHE_TTL, ids[name])
 
-    # Check if the request was successful
-    if response.status_code != 200:
-        raise Exception(f"API to get Game IDs request failed with status code {response.status_code}: {response.text}")
-    data = response.json()
-    # Return the JSON response, which maps game names to their IDs
-    return data.get(game_name)
+    return {name: ids[name] for name in game_names}
 
 
-def get_game_info(game_id: str) -> Dict:
+def get_game_id(game_name: str) -> Optional[str]:
     """
-    Fetch game information from IsThereAnyDeal API using the game ID.
+    Returns the ID of a single game, see `get_game_ids`.
 
     Args:
-        game_id (str): The unique ID of the game.
+        game_name (str): The title of the game.
 
     Returns:
-        Dict: A dictionary containing game information.
+        Optional[str]: The game ID, or None if not found.
     """
-    url: str = "https://api.isthereanydeal.com/games/info/v2"
+    return get_game_ids([game_name])[game_name]
 
-    # Parameters to be sent with the request
-    params: Dict[str, str] = {
-        'key': API_KEY,  # API key from .env
-        'id': game_id  # Game ID to look up
-    }
-
-    # Send GET request
-    response = requests.get(url, params=params)
-
-    # Check if the request was successful
-    if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
-
-    # Return the JSON response containing game information
-    return response.json()
 
+def get_prices(game_ids: List[str], country: str) -> Dict[str, Dict]:
+    """
+    Fetch the prices/v3 data of several games, in as few requests as the endpoint allows
+    (PRICES_BATCH_SIZE games each).
 
-def get_original_price(game_name: str, country: str, platform: str) -> Dict:
-    url = "https://api.isthereanydeal.com/games/prices/v3"
-    if not (is_valid_iso2_country_code(country)):
-        raise ValueError("Not a valid country code")
-    game_id = get_game_id(game_name)
+    Args:
+        game_ids (List[str]): The unique IDs of the games.
+        country (str): Two-letter country code.
 
+    Returns:
+        Dict[str, Dict]: The price data of each game keyed by its ID. Games the API has no data for are left out.
+    """
     # Set up the query parameters
     params = {
-        "key": API_KEY,
         "country": country
     }
 
-    # The body of the POST request contains the game_id as a list
-    body = [game_id]
-    headers = {"Content-Type": "application/json"}
-
-    logging.info("Request URL: %s", url)
-    logging.info("Request Params: %s", params)
-    logging.info("Request Headers: %s", headers)
-    logging.info("Request Body: %s", body)
+    # The body of each POST request contains a batch of the game IDs as a list
+    game_ids = list(dict.fromkeys(game_ids))
+    prices: Dict[str, Dict] = {}
+    for i in range(0, len(game_ids), PRICES_BATCH_SIZE):
+        body = game_ids[i:i + PRICES_BATCH_SIZE]
+        logging.debug("Request URL: %s, Params: %s, Body: %s", PRICES_URL, params, body)
 
-    response = requests.post(url, params=params, json=body, headers=headers)
+        # Send POST request to the API
+        data = _request_json("POST", PRICES_URL, params, body, PRICE_RESPONSE_TTL)
+        if not isinstance(data, list):
+            raise Exception(f"Unexpected response for games {body} in country '{country}'.")
+        prices.update((game_data["id"], game_data) for game_data in data)
+    return prices
 
-    # Raise an error if the request failed
-    if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
 
-    data = response.json()
-
-    # Access nested game data within the response
-    if isinstance(data, list) and data:
-        game_data = data[0]  # Access the first dictionary in the list
-    else:
+def _get_game_prices(game_id: Optional[str], country: str) -> Dict:
+    """
+    Returns the prices/v3 data of a single game, raising if the API has none.
+    """
+    game_data = get_prices([game_id], country).get(game_id)
+    if game_data is None:
         raise Exception(f"No data found for the game '{game_id}' in country '{country}'.")
+    return game_data
 
-    # Collect all regular prices from the deals
-    regular_prices = []
-    currency = game_data.get("deals", [])[0]["price"]["currency"]
-    for deal in game_data.get("deals", []):
-        regular_price = deal.get("regular", {}).get("amount")
-        if regular_price is not None:
-            regular_prices.append(regular_price)
-    # Calculate the mode (most common value) as the original price
-    if not regular_prices:
-        raise Exception("No regular prices found in the deals.")
 
-    original_price = Counter(regular_prices).most_common(1)[0][0]
-    logging.info(f"Most common original price: {original_price}")
-    return {"original_price": original_price, "currency": currency}
+@_ttl_cached
+def get_game_info(game_id: str) -> Dict:
+    """
+    Fetch game information from IsThereAnyDeal API using the game ID.
 
+    Args:
+        game_id (str): The unique ID of the game.
 
-def current_best_deal(game_name: str, country: str, platform: str) -> List[Dict]:
-    url = "https://api.isthereanydeal.com/games/prices/v3"
-    if not (is_valid_iso2_country_code(country)):
-        raise ValueError("Not a valid country code")
-    game_id = get_game_id(game_name)
+    Returns:
+        Dict: A dictionary containing game information.
+    """
+    url: str = "https://api.isthereanydeal.com/games/info/v2"
 
-    # Set up the query parameters
-    params = {
-        "key": API_KEY,
-        "country": country
+    # Parameters to be sent with the request, the API key comes from the session
+    params: Dict[str, str] = {
+        'id': game_id  # Game ID to look up
     }
 
-    # The body of the POST request contains the game_id as a list
-    body = [
-        game_id
-    ]
+    # Send GET request and return the JSON response containing game information
+    return _request_json("GET", url, params, None, GAME_INFO_RESPONSE_TTL)
 
-    headers = {
-        "Content-Type": "application/json"
-    }
 
-    logging.info("Request URL: %s", url)
-    logging.info("Request Params: %s", params)
-    logging.info("Request Headers: %s", headers)
-    logging.info("Request Body: %s", body)
+@_ttl_cached
+def get_original_price_by_id(game_id: str, country: str) -> Dict:
+    """
+    Fetch the original price of a game, the most common regular price across its deals.
 
-    # Send POST request to the API
-    response = requests.post(url, params=params, json=body, headers=headers)
+    Args:
+        game_id (str): The unique ID of the game.
+        country (str): Two-letter country code.
 
-    # Raise an error if the request failed
-    if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
+    Returns:
+        Dict: The original price and its currency.
+    """
+    if not (is_valid_iso2_country_code(country)):
+        raise ValueError("Not a valid country code")
+    game_data = _get_game_prices(game_id, country)
+    return parse_original_price(game_data)
 
-    # Parse the response JSON
-    data = response.json()
 
-    # Ensure that the data is a list and access the first element
-    if isinstance(data, list) and data:
-        game_data = data[0]  # Access the first dictionary in the list
-    else:
-        raise Exception(f"No data found for the game '{game_id}' in country '{country}'.")
+def get_original_price(game_name: str, country: str, platform: str) -> Dict:
+    """
+    Looks up the game ID by name and calls `get_original_price_by_id`.
+    """
+    return get_original_price_by_id(get_game_id(game_name), country)
 
-    # Filter deals based on the platform
-    filtered_deals = []
-    deals = game_data.get("deals", [])
 
-    # Get the minimum price for the specified platform
-    min_price = None
-    for deal in deals:
-        platforms = [p["name"] for p in deal["platforms"]]
-        if platform in platforms:
-            price = deal["price"]["amount"]
-            if min_price is None or price < min_price:
-                min_price = price
-
-    # Collect all deals that match the minimum price and return only relevant data
-    result = []
-    for deal in deals:
-        platforms = [p["name"] for p in deal["platforms"]]
-        if platform in platforms and deal["price"]["amount"] == min_price:
-            result.append({
-                "store_name": deal["shop"]["name"],
-                "currency": deal["price"]["currency"],
-                "current_price": deal["price"]["amount"],
-                "original_price": deal["regular"]["amount"],
-                "url": deal["url"],
-                "timestamp": deal["timestamp"]
-            })
+@_ttl_cached
+def current_best_deal_by_id(game_id: str, country: str, platform: str) -> List[Dict]:
+    """
+    Fetch the cheapest current deals of a game on a platform.
+
+    Args:
+        game_id (str): The unique ID of the game.
+        country (str): Two-letter country code.
+        platform (str): The platform the deals must be available on.
+
+    Returns:
+        List[Dict]: Every store offering the minimum price.
+    """
+    if not (is_valid_iso2_country_code(country)):
+        raise ValueError("Not a valid country code")
+    game_data = _get_game_prices(game_id, country)
 
     # Return the filtered list of stores with relevant data
-    return result
+    return parse_best_deals(game_data, platform)
+
+
+def current_best_deal(game_name: str, country: str, platform: str) -> List[Dict]:
+    """
+    Looks up the game ID by name and calls `current_best_deal_by_id`.
+    """
+    return current_best_deal_by_id(get_game_id(game_name), country, platform)
 
 
-def get_current_lowest_price(game_id: str, country: str, platform: str) -> Dict:
+def get_current_lowest_price_by_id(game_id: str, country: str, platform: str) -> Dict:
     """
-    Uses get_current_best_deals to get the current_lowerst price
+    Uses current_best_deal_by_id to get the current lowest price
     """
-    best_deals = current_best_deal(game_id, country, platform)
+    best_deals = current_best_deal_by_id(game_id, country, platform)
     lowest = {"current_price": best_deals[0].get("current_price"), "currency": best_deals[0].get("currency")}
     return lowest
 
 
-def get_all_time_low_price(game_name: str, country: str) -> Dict:
+def get_current_lowest_price(game_name: str, country: str, platform: str) -> Dict:
+    """
+    Looks up the game ID by name and calls `get_current_lowest_price_by_id`.
+    """
+    return get_current_lowest_price_by_id(get_game_id(game_name), country, platform)
+
+
+@_ttl_cached
+def get_all_time_low_price_by_id(game_id: str, country: str) -> Dict:
     """
     Fetch the all-time lowest game price from IsThereAnyDeal API for a given game ID and country.
 
@@ -219,38 +390,89 @@ def get_all_time_low_price(game_name: str, country: str) -> Dict:
         Dict: A dictionary containing the all-time lowest price information, if available.
     """
     if not (is_valid_iso2_country_code(country)):
-        return ValueError("Not a valid country code")
-    game_id = get_game_id(game_name)
-    url = "https://api.isthereanydeal.com/games/prices/v3"
+        raise ValueError("Not a valid country code")
+    game_data = _get_game_prices(game_id, country)
 
-    # Set up the query parameters
-    params = {
-        "key": API_KEY,
-        "country": country
-    }
+    return parse_all_time_low(game_data, country)
 
-    body = [
-        game_id
-    ]
 
-    headers = {
-        "Content-Type": "application/json"
-    }
-    # Send POST request to the API
-    response = requests.post(url, params=params, json=body, headers=headers)
+def get_all_time_low_price(game_name: str, country: str) -> Dict:
+    """
+    Looks up the game ID by name and calls `get_all_time_low_price_by_id`.
+    """
+    return get_all_time_low_price_by_id(get_game_id(game_name), country)
 
-    # Raise an error if the request failed
-    if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
 
-    # Parse the response JSON
-    data = response.json()
-    if isinstance(data, list) and data:
-        game_data = data[0]  # Access the first dictionary in the list
-    else:
-        raise Exception(f"No data found for the game '{game_id}' in country '{country}'.")
+def parse_original_price(game_data: Dict) -> Dict:
+    """
+    Works out the original price of a game from one entry of the prices/v3 response.
+
+    Args:
+        game_data (Dict): The price data of a single game as returned by the API.
+
+    Returns:
+        Dict: The most common regular price across the deals and its currency.
+    """
+    # Count the regular prices of the deals in a single pass
+    deals = game_data.get("deals", ())
+    regular_prices = Counter(deal["regular"]["amount"] for deal in deals
+                             if deal.get("regular", {}).get("amount") is not None)
+    # Calculate the mode (most common value) as the original price
+    if not regular_prices:
+        raise Exception("No regular prices found in the deals.")
+
+    currency = deals[0]["price"]["currency"]
+    original_price, _ = max(regular_prices.items(), key=lambda item: item[1])
+    logging.debug("Most common original price: %s", original_price)
+    return {"original_price": original_price, "currency": currency}
+
+
+def parse_best_deals(game_data: Dict, platform: str) -> List[Dict]:
+    """
+    Picks the cheapest deals for a platform from one entry of the prices/v3 response.
+
+    Args:
+        game_data (Dict): The price data of a single game as returned by the API.
+        platform (str): The platform the deals must be available on.
+
+    Returns:
+        List[Dict]: Every store offering the minimum price, with only the relevant fields.
+    """
+    # Track the minimum price for the specified platform and the deals offering it in a single pass
+    min_price = None
+    cheapest = []
+    for deal in game_data.get("deals", []):
+        if not any(p["name"] == platform for p in deal["platforms"]):
+            continue
+        price = deal["price"]["amount"]
+        if min_price is None or price < min_price:
+            min_price, cheapest = price, [deal]
+        elif price == min_price:
+            cheapest.append(deal)
+
+    # Return only the relevant data of the cheapest deals
+    return [{
+        "store_name": deal["shop"]["name"],
+        "currency": deal["price"]["currency"],
+        "current_price": deal["price"]["amount"],
+        "original_price": deal["regular"]["amount"],
+        "url": deal["url"],
+        "timestamp": deal["timestamp"]
+    } for deal in cheapest]
+
+
+def parse_all_time_low(game_data: Dict, country: str) -> Dict:
+    """
+    Extracts the all-time low price from one entry of the prices/v3 response.
 
-        # Extract the all-time low price from historyLow
+    Args:
+        game_data (Dict): The price data of a single game as returned by the API.
+        country (str): Two-letter country code the data was requested for.
+
+    Returns:
+        Dict: The all-time low price and its currency.
+    """
+    # Extract the all-time low price from historyLow
     history_low = game_data.get("historyLow", {}).get("all", {})
 
     if history_low:
@@ -260,7 +482,7 @@ def get_all_time_low_price(game_name: str, country: str) -> Dict:
         }
 
     # If no all-time low price found, raise an exception
-    raise Exception(f"All-time low price not found for the game '{game_id}' in country '{country}'.")
+    raise Exception(f"All-time low price not found for the game '{game_data.get('id')}' in country '{country}'.")
 
 
 def is_valid_iso2_country_code(country_code: str) -> bool:
@@ -273,8 +495,4 @@ def is_valid_iso2_country_code(country_code: str) -> bool:
     Returns:
         bool: True if the country code is valid, False otherwise.
     """
-    try:
-        # Use pycountry to look for the country with the given alpha_2 code
-        return pycountry.countries.get(alpha_2=country_code.upper()) is not None
-    except KeyError:
-        return False
+    return country_code.upper() in _ISO2_COUNTRY_CODES
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from api import API_KEY, JSON_HEADERS, PRICES_BATCH_SIZE, PRICES_URL, PRICE_RESPONSE_TTL, STALE_IF_ERROR, \
+    is_valid_iso2_country_code, response_cache_key
+from dbdriver import cache_get, cache_set
+
+MAX_CONCURRENT_REQUESTS: int = 10  # Requests in flight at once per session, keeps ITAD's rate limits at bay
+# Throttled and failed requests are retried with exponential backoff, like the requests session in api.py
+MAX_RETRIES: int = 3
+RETRY_BACKOFF: float = 0.3
+MAX_RETRY_DELAY: float = 30.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates a session for the IsThereAnyDeal API that allows at most MAX_CONCURRENT_REQUESTS requests at once.
+    Long-running callers should create one and pass it to every call, so connections are reused.
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS))
+
+
+async def _post(session: aiohttp.ClientSession, url: str, body: str, params: Dict[str, str]) -> str:
+    """
+    Sends a POST request to the IsThereAnyDeal API and returns the response body. Connection errors and
+    RETRY_STATUSES responses are retried up to MAX_RETRIES times, waiting as long as a Retry-After header asks.
+
+    Args:
+        session (aiohttp.ClientSession): The session the request is sent through.
+        url (str): The endpoint to call.
+        body (str): The already serialized JSON body.
+        params (Dict[str, str]): Query parameters, the API key is added to them.
+
+    Returns:
+        str: The JSON body as text.
+    """
+    params = {"key": API_KEY, **params}
+    for attempt in range(MAX_RETRIES + 1):
+        delay = min(RETRY_BACKOFF * 2 ** attempt, MAX_RETRY_DELAY)
+        try:
+            async with session.post(url, params=params, data=body, headers=JSON_HEADERS) as response:
+                if response.status == 200:
+                    return await response.text()
+                if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    raise Exception(f"API request failed with status code {response.status}: {await response.text()}")
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = min(float(retry_after), MAX_RETRY_DELAY)
+        except aiohttp.ClientError:
+            if attempt == MAX_RETRIES:
+                raise
+        logging.warning("Retrying %s in %.1fs (attempt %d of %d)", url, delay, attempt + 1, MAX_RETRIES)
+        await asyncio.sleep(delay)
+
+
+def _read_cache(cache_key: str) -> Optional[Tuple[str, int]]:
+    """
+    Reads a cached response, treating an unreadable cache like a miss.
+    """
+    try:
+        return cache_get(cache_key, max_stale=STALE_IF_ERROR)
+    except sqlite3.Error as e:
+        logging.warning("Could not read the API cache: %s", e)
+        return None
+
+
+def _write_cache(cache_key: str, text: str) -> None:
+    """
+    Stores a prices response, a failure to do so is only logged.
+    """
+    try:
+        cache_set(cache_key, text, PRICE_RESPONSE_TTL)
+    except sqlite3.Error as e:
+        logging.warning("Could not write the API cache: %s", e)
+
+
+async def _get_prices(session: aiohttp.ClientSession, game_ids: List[str], country: str) -> Dict[str, Dict]:
+    """
+    Fetches the prices/v3 data of a batch of games in a single request, keyed by game ID. Responses share the
+    persistent cache with api.py, so a batch fetched within PRICE_RESPONSE_TTL, even before a restart, is not
+    requested again, and an expired one is used if the request fails.
+    """
+    body = json.dumps(game_ids)
+    params = {"country": country}
+    cache_key = response_cache_key("POST", PRICES_URL, params, body)
+    cached = await asyncio.to_thread(_read_cache, cache_key)
+
+    if cached is not None and cached[1] >= time.time():
+        text = cached[0]
+    else:
+        try:
+            text = await _post(session, PRICES_URL, body, params)
+        except Exception as e:
+            if cached is None:
+                raise
+            logging.warning("Prices request failed, serving a cached response instead: %s", e)
+            text = cached[0]
+        else:
+            await asyncio.to_thread(_write_cache, cache_key, text)
+
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise Exception(f"Unexpected response for games {game_ids} in country '{country}'.")
+    return {game_data["id"]: game_data for game_data in data}
+
+
+async def get_prices_many(game_ids: List[str], country: str,
+                          session: Optional[aiohttp.ClientSession] = None) -> Dict[str, Dict]:
+    """
+    Fetches the price data of many games for one country. The IDs are sent in batches of
+    PRICES_BATCH_SIZE per request, and the batches are sent concurrently.
+
+    Args:
+        game_ids (List[str]): The unique IDs of the games.
+        country (str): Two-letter country code.
+        session (Optional[aiohttp.ClientSession]): The session to send the requests through. Without one, a
+            session is opened for this call only.
+
+    Returns:
+        Dict[str, Dict]: The prices/v3 entry of each game keyed by game ID. Games that could not be
+        fetched are logged and left out.
+    """
+    if not is_valid_iso2_country_code(country):
+        raise ValueError("Not a valid country code")
+    if session is None:
+        async with create_session() as session:
+            return await get_prices_many(game_ids, country, session)
+
+    game_ids = list(dict.fromkeys(game_ids))  # Drop duplicates but keep the order
+    batches = [game_ids[i:i + PRICES_BATCH_SIZE] for i in range(0, len(game_ids), PRICES_BATCH_SIZE)]
+
+    results = await asyncio.gather(*[_get_prices(session, batch, country) for batch in batches],
+                                   return_exceptions=True)
+
+    prices: Dict[str, Dict] = {}
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            logging.error("Failed to fetch prices for games %s in country '%s': %s", batch, country, result)
+        else:
+            prices.update(result)
+    return prices
+
+
+def fetch_prices_many(game_ids: List[str], country: str) -> Dict[str, Dict]:
+    """
+    Synchronous entrypoint for `get_prices_many`, for callers without a running event loop.
+    """
+    return asyncio.run(get_prices_many(game_ids, country))
@@ -1,3 +1,6 @@
+from typing import Callable, Optional
+
+
 def all_time_low_compare(current_price: float, all_time_low_price: float) -> bool:
     """
     Compares current price with all-time low price.
@@ -88,3 +91,38 @@ def is_in_price_range(current_price: float, min_price: float, max_price: float)
         bool: True if the price is within the specified range, False otherwise.
     """
     return min_price <= current_price <= max_price
+
+
+def evaluate_watches(watch_types: list[str], current_prices: list[float], original_prices: list[float],
+                     target_values: list[Optional[float]], all_time_lows: list[Optional[float]]) -> list[bool]:
+    """
+    Evaluates a batch of price watches in one pass. The lists are parallel, entry i describes watch i.
+
+    Args:
+        watch_types (list[str]): The watch type of each watch ('all time low', 'lower than' or 'discount').
+        current_prices (list[float]): The current price of each game.
+        original_prices (list[float]): The original price of each game.
+        target_values (list[Optional[float]]): The max price or discount percentage, depending on the watch type.
+        all_time_lows (list[Optional[float]]): The all-time low price, only needed for 'all time low' watches.
+
+    Returns:
+        list[bool]: For each watch, True if its condition is met, False otherwise. Unknown watch types and
+        watches without a current price are never met.
+    """
+    return [
+        watch_type in _WATCH_CHECKS and current is not None
+        and _WATCH_CHECKS[watch_type](current, original, target, all_time_low)
+        for watch_type, current, original, target, all_time_low
+        in zip(watch_types, current_prices, original_prices, target_values, all_time_lows)
+    ]
+
+
+# Condition of each watch type, called with (current_price, original_price, target_value, all_time_low)
+_WATCH_CHECKS: dict[str, Callable[[float, float, Optional[float], Optional[float]], bool]] = {
+    "all time low": lambda current, original, target, all_time_low:
+        bool(all_time_low) and all_time_low_compare(current, all_time_low),
+    "discount": lambda current, original, target, all_time_low:
+        target is not None and percentage_compare(current, original, target),
+    "lower than": lambda current, original, target, all_time_low:
+        bool(target) and is_below_target_price(current, target),
+}
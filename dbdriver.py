@@ -1,43 +1,263 @@
+import atexit
+import itertools
+import logging
+import re
 import sqlite3
-from typing import List, Tuple, Optional, Dict, Any
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Tuple, Optional, Dict, Any, Iterator
 from dotenv import load_dotenv
 import os
-from cron_descriptor import get_description
 from croniter import croniter
 from datetime import datetime, timedelta
 
+load_dotenv()
 DB_FILE = os.getenv("DB_FILE")
 
+# Columns of a game watch entry as shown to users, next_run is internal bookkeeping
+_COLUMNS = ("id", "game_id", "game_name", "price_watch_type", "cron_schedule", "country", "target_value", "platform")
+_COLUMN_LIST = ", ".join(_COLUMNS)
+
+# Schema set up by init_db
+_SQL_SCHEMA = '''
+    -- WAL lets readers run alongside a writer and, with synchronous=NORMAL, skips the fsync on every commit
+    PRAGMA journal_mode=WAL;
+
+    -- The game_watch table with a single target_value field
+    CREATE TABLE IF NOT EXISTS game_watch (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id TEXT NOT NULL,
+    game_name TEXT NOT NULL,
+    price_watch_type TEXT NOT NULL,
+    cron_schedule TEXT NOT NULL,
+    country TEXT NOT NULL DEFAULT "US",
+    target_value REAL DEFAULT NULL,
+    platform TEXT,
+    next_run INTEGER
+    );
+    -- Updates, deletes and schedule lookups all filter on game_id
+    CREATE INDEX IF NOT EXISTS idx_game_watch_game_id ON game_watch(game_id);
+
+    -- Persistent cache of IsThereAnyDeal responses, so restarts don't re-fetch everything
+    CREATE TABLE IF NOT EXISTS api_cache (
+    cache_key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at INTEGER NOT NULL
+    );
+'''
+
+# SQL used at runtime, kept as constants so sqlite3's statement cache sees the exact same string every call
+_SQL_INSERT_WATCH = '''
+    INSERT INTO game_watch (game_id, game_name, price_watch_type, cron_schedule, country, target_value,
+                            platform, next_run)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+_SQL_INSERT_PLACEHOLDERS = '(?, ?, ?, ?, ?, ?, ?, ?)'
+_SQL_INSERT_WATCH_RETURNING = _SQL_INSERT_WATCH + '    ON CONFLICT(game_name) DO NOTHING RETURNING id\n'
+_SQL_WATCH_EXISTS = 'SELECT 1 FROM game_watch WHERE game_id = ? LIMIT 1'
+_SQL_SELECT_NAMES = 'SELECT DISTINCT game_name FROM game_watch'
+_SQL_SELECT_INFO_BY_NAME = f'SELECT {_COLUMN_LIST} FROM game_watch WHERE game_name = ?'
+_SQL_SELECT_ALL_INFO = f'SELECT {_COLUMN_LIST} FROM game_watch'
+_SQL_SELECT_SCHEDULE = 'SELECT cron_schedule FROM game_watch WHERE game_id = ?'
+_SQL_DELETE_BY_ID = 'DELETE FROM game_watch WHERE game_id = ?'
+_SQL_DELETE_BY_NAME = 'DELETE FROM game_watch WHERE game_name = ?'
+_SQL_UPDATE_SCHEDULE = 'UPDATE game_watch SET cron_schedule = ?, next_run = ? WHERE game_id = ?'
+_SQL_SELECT_ALL_WATCHES = 'SELECT game_id, game_name, price_watch_type, cron_schedule FROM game_watch'
+_SQL_SELECT_DUE = ('SELECT id, game_id, game_name, country, price_watch_type, cron_schedule, target_value, platform, '
+                   'next_run FROM game_watch WHERE next_run < ?')
+_SQL_UPDATE_NEXT_RUN = 'UPDATE game_watch SET next_run = ? WHERE id = ?'
+_SQL_CACHE_GET = 'SELECT value, expires_at FROM api_cache WHERE cache_key = ? AND expires_at >= ?'
+_SQL_CACHE_SET = 'INSERT OR REPLACE INTO api_cache (cache_key, value, expires_at) VALUES (?, ?, ?)'
+
+# Valid values of price_watch_type and platform
+ALLOWED_WATCH_TYPES = frozenset({'all time low', 'lower than', 'discount'})
+ALLOWED_PLATFORMS = frozenset({'Windows', 'MacOS', 'PS5', 'Xbox', 'Switch'})
+
+# Rows per INSERT statement in add_game_watches_bulk, 8 parameters each stays well below SQLite's variable limit
+BULK_INSERT_CHUNK_SIZE = 100
+
+# Expired cache entries are kept this long, so they can still be served while the API is down
+API_CACHE_RETENTION = 86400
+
+# Each thread keeps one open connection instead of reconnecting on every call
+_tls = threading.local()
+# Every open connection of any thread, so they can all be closed when the process exits. The set only holds
+# weak references: when a thread exits its thread-local connection is dropped, which closes it
+_connections: "weakref.WeakSet[sqlite3.Connection]" = weakref.WeakSet()
+_connections_lock = threading.Lock()
+
+
+class _Connection(sqlite3.Connection):
+    """
+    sqlite3.Connection itself can't be weakly referenced, this subclass can.
+    """
+
+
+def _conn() -> sqlite3.Connection:
+    """
+    Returns the calling thread's connection to DB_FILE, opening and tuning it on first use.
+    The connection runs in autocommit mode, so every statement is committed on its own, and returns
+    rows as `sqlite3.Row`, which can be indexed by position or by column name.
+    """
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        # Room for every _SQL_* constant plus the bulk and update variants, so none is prepared twice
+        # uri=True also accepts "file:" URIs such as shared in-memory databases, plain paths work as before
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None, cached_statements=256,
+                               uri=True, factory=_Connection)
+        conn.row_factory = sqlite3.Row
+        # These settings only last for the connection, journal_mode is stored in the file by init_db
+        conn.executescript('''
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        ''')
+        _tls.conn = conn
+        with _connections_lock:
+            _connections.add(conn)
+    return conn
+
+
+def close_connection() -> None:
+    """
+    Closes the calling thread's connection, a later call reopens it.
+    """
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        _tls.conn = None
+        with _connections_lock:
+            _connections.discard(conn)
+
+
+def configure(db_file: str) -> None:
+    """
+    Points the module at another database, used instead of the DB_FILE environment variable. The calling
+    thread's connection is closed so its next call opens the new database, connections that other threads
+    already opened keep using the old one until they are closed.
+
+    Args:
+        db_file (str): Path or "file:" URI of the SQLite database.
+    """
+    global DB_FILE
+    DB_FILE = db_file
+    close_connection()
+
+
+@atexit.register
+def _close_all_connections() -> None:
+    """
+    Closes the connections of all threads, so WAL is checkpointed and cleaned up on exit.
+    """
+    with _connections_lock:
+        for conn in list(_connections):
+            conn.close()
+        _connections.clear()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Runs the statements of the block in a single write transaction, committed once at the end or rolled back
+    if the block raises. Inside a transaction that is already open the block runs in a savepoint instead, so
+    a failing block only undoes its own statements.
+
+    Yields:
+        sqlite3.Connection: The calling thread's connection.
+    """
+    conn = _conn()
+    if conn.in_transaction:
+        conn.execute('SAVEPOINT nested_transaction')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK TO nested_transaction')
+            conn.execute('RELEASE nested_transaction')
+            raise
+        conn.execute('RELEASE nested_transaction')
+        return
+    # IMMEDIATE takes the write lock up front, so the block can't fail halfway on a busy database
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _current_hour() -> datetime:
+    """
+    Returns the start of the current hour.
+    """
+    return datetime.now().replace(minute=0, second=0, microsecond=0)
+
+
+# Shape of a standard five-field cron expression. Aliases like @daily and 6 or 7 field forms are rejected:
+# croniter reads a sixth field as trailing seconds where cron_descriptor, which describes schedules to users,
+# reads a leading one, so the bot would show a different schedule than the one that runs
+_CRON_SHAPE = re.compile(r"\S+(?:\s+\S+){4}")
+
+
+# Watches share a handful of schedules and are always scheduled from an hour boundary, so results repeat a lot
+@lru_cache(maxsize=512)
+def _is_valid_schedule(schedule: str) -> bool:
+    """
+    Returns whether `schedule` is a valid cron expression.
+    """
+    # Strings with the wrong number of fields are rejected without letting croniter parse and raise
+    return _CRON_SHAPE.fullmatch(schedule.strip()) is not None and croniter.is_valid(schedule)
+
+
+@lru_cache(maxsize=512)
+def _next_run(schedule: str, start: datetime) -> int:
+    """
+    Returns the timestamp of the first time `schedule` fires at or after `start`.
+    """
+    return int(croniter(schedule, start - timedelta(seconds=1)).get_next(datetime).timestamp())
+
 
 def init_db():
     """
     Initialize the database and create the game_watch table if it doesn't exist.
+    Older databases get the next_run column added and filled in, and duplicate game names removed.
     """
 
-    load_dotenv()
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    # Create the game_watch table with a single target_value field
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS game_watch (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        game_id TEXT NOT NULL,
-        game_name TEXT NOT NULL,
-        price_watch_type TEXT NOT NULL,
-        cron_schedule TEXT NOT NULL, 
-        country TEXT NOT NULL DEFAULT "US",
-        target_value REAL DEFAULT NULL,
-        platform TEXT 
-        );
-    ''')
+    # The whole schema is created in one script, the next_run and game_name indexes have to wait for the
+    # migrations below
+    cursor.executescript(_SQL_SCHEMA)
+
+    # Older databases could hold several watches for one game name, only the oldest of them is kept so the
+    # unique index can be created
+    with transaction():
+        cursor.execute('DELETE FROM game_watch WHERE id NOT IN (SELECT MIN(id) FROM game_watch GROUP BY game_name)')
+        if cursor.rowcount:
+            logging.warning("Removed %d game watches whose game name was already watched", cursor.rowcount)
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_game_watch_game_name ON game_watch(game_name)')
+
+    # next_run holds the timestamp of the next scheduled check, so due watches are found with an index range scan
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(game_watch)')]
+    if "next_run" not in columns:
+        cursor.execute('ALTER TABLE game_watch ADD COLUMN next_run INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_watch_next_run ON game_watch(next_run)')
+
+    cursor.execute('DELETE FROM api_cache WHERE expires_at < ?', (int(time.time()) - API_CACHE_RETENTION,))
 
-    conn.commit()
-    conn.close()
+    current_hour = _current_hour()
+    pending = [(_next_run(schedule, current_hour), row_id) for row_id, schedule
+               in cursor.execute('SELECT id, cron_schedule FROM game_watch WHERE next_run IS NULL')]
+    cursor.executemany(_SQL_UPDATE_NEXT_RUN, pending)
 
 
 def add_game_watch(game_id: str, game_name: str, price_watch_type: str, schedule: str,
-                   country: str = "US", target_value: Optional[float] = None, platform: str = "Windows") -> None:
+                   country: str = "US", target_value: Optional[float] = None, platform: str = "Windows") -> int:
     """
     Adds a game watch entry to the database with validation on watch type and cron schedule.
 
@@ -49,46 +269,90 @@ def add_game_watch(game_id: str, game_name: str, price_watch_type: str, schedule
         country (str): The country code for the watch, default is "US".
         target_value (Optional[float]): Represents either max_price or discount_percentage, depending on `price_watch_type`
         platform (Optional[str]): What platform is the game on MacOS, PS5, Windows etc. Default is Windows
+
+    Returns:
+        int: The ID of the new entry.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    values = _prepare_watch_rows([(game_id, game_name, price_watch_type, schedule, country, target_value, platform)])
 
-    # Check if game watch already exists
-    cursor.execute('SELECT * FROM game_watch WHERE game_name = ?', (game_name,))
-    game_exists = cursor.fetchone()
-    if game_exists:
+    # One statement both checks for an existing entry and inserts, no row back means the name is taken
+    cursor = _conn().cursor()
+    inserted = cursor.execute(_SQL_INSERT_WATCH_RETURNING, values[0]).fetchall()
+    if not inserted:
         raise FileExistsError(
             f"The entry with game name '{game_name}' already exists. Please delete or use update_game function.")
+    return inserted[0][0]
 
-    # Validate watch type
-    allowed_watch_types = ['all time low', 'lower than', 'discount']
-    if price_watch_type not in allowed_watch_types:
-        raise ValueError("Not a valid watch type. Allowed types are: 'all time low', 'lower than', 'discount'.")
 
-    # Validate target_value based on watch type
-    if price_watch_type == "lower than" and target_value is None:
-        raise ValueError("target_value is required as max_price for 'lower than' watch type.")
-    if price_watch_type == "discount" and target_value is None:
-        raise ValueError("target_value is required as discount_percentage for 'discount' watch type.")
-    if price_watch_type == "all time low" and target_value is not None:
-        raise ValueError("'all time low' watch type should not have a target_value.")
+def add_game_watches_bulk(rows: List[Tuple[str, str, str, str, str, Optional[float], str]]) -> None:
+    """
+    Adds several game watch entries in a single transaction. Every row is validated like in `add_game_watch`
+    before anything is written, and if any row fails none of them are added.
+
+    Args:
+        rows (List[Tuple[str, str, str, str, str, Optional[float], str]]): One tuple of
+            (game_id, game_name, price_watch_type, schedule, country, target_value, platform) per watch.
+    """
+    values = _prepare_watch_rows(rows)
+    full = len(values) - len(values) % BULK_INSERT_CHUNK_SIZE
 
-    # Validate cron schedule and generate a description
+    # Insert the game watches in one transaction, BULK_INSERT_CHUNK_SIZE rows per statement.
+    # The unique index on game_name rejects duplicates
     try:
-        description = get_description(schedule)
-        if description is None:
-            raise ValueError("Invalid cron schedule.")
-    except Exception as e:
-        raise ValueError(f"Invalid cron schedule: {schedule}. Error: {e}")
+        with transaction() as conn:
+            if full:
+                conn.executemany(_insert_many_sql(BULK_INSERT_CHUNK_SIZE), [
+                    tuple(itertools.chain.from_iterable(values[i:i + BULK_INSERT_CHUNK_SIZE]))
+                    for i in range(0, full, BULK_INSERT_CHUNK_SIZE)
+                ])
+            if values[full:]:
+                conn.execute(_insert_many_sql(len(values) - full),
+                             tuple(itertools.chain.from_iterable(values[full:])))
+    except sqlite3.IntegrityError:
+        raise FileExistsError("One of the game names already has an entry or is listed twice. No watches were added.")
+
+
+@lru_cache(maxsize=None)
+def _insert_many_sql(count: int) -> str:
+    """
+    Returns an INSERT statement adding `count` game watches at once.
+    """
+    return _SQL_INSERT_WATCH.replace(_SQL_INSERT_PLACEHOLDERS, ", ".join([_SQL_INSERT_PLACEHOLDERS] * count))
+
+
+@lru_cache(maxsize=None)
+def _update_sql(fields: Tuple[str, ...]) -> str:
+    """
+    Returns the UPDATE statement setting `fields` on the entry with a given game_id.
+    """
+    set_clause = ", ".join([f"{field} = ?" for field in fields])
+    return f'UPDATE game_watch SET {set_clause} WHERE game_id = ?'
+
 
-    # Insert the game watch into the database
-    cursor.execute('''
-        INSERT INTO game_watch (game_id, game_name, price_watch_type, cron_schedule, country, target_value, platform)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (game_id, game_name, price_watch_type, schedule, country, target_value, platform))
+def _prepare_watch_rows(rows: List[Tuple[str, str, str, str, str, Optional[float], str]]) -> List[Tuple]:
+    """
+    Validates new game watch rows and returns them with their first next_run appended, ready for insertion.
+    """
+    for game_id, game_name, price_watch_type, schedule, country, target_value, platform in rows:
+        # Validate watch type
+        if price_watch_type not in ALLOWED_WATCH_TYPES:
+            raise ValueError("Not a valid watch type. Allowed types are: 'all time low', 'lower than', 'discount'.")
+
+        # Validate target_value based on watch type
+        if price_watch_type == "lower than" and target_value is None:
+            raise ValueError("target_value is required as max_price for 'lower than' watch type.")
+        if price_watch_type == "discount" and target_value is None:
+            raise ValueError("target_value is required as discount_percentage for 'discount' watch type.")
+        if price_watch_type == "all time low" and target_value is not None:
+            raise ValueError("'all time low' watch type should not have a target_value.")
+
+    # Validate cron schedules
+    invalid_schedules = [row[3] for row in rows if not _is_valid_schedule(row[3])]
+    if invalid_schedules:
+        raise ValueError(f"Invalid cron schedule: {invalid_schedules[0]}")
 
-    conn.commit()
-    conn.close()
+    current_hour = _current_hour()
+    return [tuple(row) + (_next_run(row[3], current_hour),) for row in rows]
 
 
 def update_game_watch(
@@ -112,24 +376,18 @@ def update_game_watch(
         target_value (Optional[float]): Represents either max_price or discount_percentage, depending on `price_watch_type`.
         platform (Optional[str]): The platform for the game (e.g., 'Windows', 'MacOS', 'PS5').
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    # Check if the game watch entry exists using game_id
-    cursor.execute('SELECT * FROM game_watch WHERE game_id = ?', (game_id,))
-    if not cursor.fetchone():
-        raise FileNotFoundError(f"No game watch entry found with ID {game_id}")
-
     # Allowed watch types
-    allowed_watch_types = ['all time low', 'lower than', 'discount']
-    if price_watch_type and price_watch_type not in allowed_watch_types:
-        raise ValueError(
-            f"Invalid price_watch_type '{price_watch_type}'. Allowed types are: {', '.join(allowed_watch_types)}.")
+    if price_watch_type and price_watch_type not in ALLOWED_WATCH_TYPES:
+        raise ValueError(f"Invalid price_watch_type '{price_watch_type}'. "
+                         f"Allowed types are: {', '.join(sorted(ALLOWED_WATCH_TYPES))}.")
 
     # Allowed platforms (optional validation)
-    allowed_platforms = ['Windows', 'MacOS', 'PS5', 'Xbox', 'Switch']
-    if platform and platform not in allowed_platforms:
-        raise ValueError(f"Invalid platform '{platform}'. Allowed platforms are: {', '.join(allowed_platforms)}.")
+    if platform and platform not in ALLOWED_PLATFORMS:
+        raise ValueError(f"Invalid platform '{platform}'. "
+                         f"Allowed platforms are: {', '.join(sorted(ALLOWED_PLATFORMS))}.")
 
     # Validate target_value based on watch type
     if price_watch_type == "lower than" and target_value is None:
@@ -139,6 +397,9 @@ def update_game_watch(
     if price_watch_type == "all time low" and target_value is not None:
         raise ValueError("'all time low' watch type should not have a target_value.")
 
+    if cron_schedule and not _is_valid_schedule(cron_schedule):
+        raise ValueError(f"Invalid cron schedule: {cron_schedule}")
+
     # Prepare fields to update based on provided values
     fields_to_update: Dict[str, Any] = {}
     if game_name:
@@ -147,6 +408,7 @@ def update_game_watch(
         fields_to_update["price_watch_type"] = price_watch_type
     if cron_schedule:
         fields_to_update["cron_schedule"] = cron_schedule
+        fields_to_update["next_run"] = _next_run(cron_schedule, _current_hour())
     if country:
         fields_to_update["country"] = country
     if target_value is not None:
@@ -154,20 +416,23 @@ def update_game_watch(
     if platform:
         fields_to_update["platform"] = platform
 
-    # Build the update query dynamically
-    set_clause = ", ".join([f"{field} = ?" for field in fields_to_update.keys()])
-    values = list(fields_to_update.values()) + [game_id]  # Values for placeholders
-
-    # Execute the update query with `game_id` in the WHERE clause
-    cursor.execute(f'''
-        UPDATE game_watch
-        SET {set_clause}
-        WHERE game_id = ?
-    ''', values)
+    if not fields_to_update:
+        # Nothing to change, only make sure the entry exists
+        cursor.execute(_SQL_WATCH_EXISTS, (game_id,))
+        if not cursor.fetchone():
+            raise FileNotFoundError(f"No game watch entry found with ID {game_id}")
+        return
 
-    conn.commit()
-    conn.close()
+    # Fields are always added in the same order above, so each combination maps to one cached statement
+    values = list(fields_to_update.values()) + [game_id]  # Values for placeholders
 
+    # Execute the update query with `game_id` in the WHERE clause, no updated row means no such entry
+    try:
+        cursor.execute(_update_sql(tuple(fields_to_update)), values)
+    except sqlite3.IntegrityError:
+        raise FileExistsError(f"The entry with game name '{game_name}' already exists.")
+    if cursor.rowcount == 0:
+        raise FileNotFoundError(f"No game watch entry found with ID {game_id}")
 
 
 def retrieve_game_names() -> List[str]:
@@ -177,51 +442,57 @@ def retrieve_game_names() -> List[str]:
     Returns:
         List[str]: A list of game names.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT DISTINCT game_name FROM game_watch')
-    game_names = [row[0] for row in cursor.fetchall()]
+    cursor.execute(_SQL_SELECT_NAMES)
+    game_names = [row[0] for row in cursor]
 
-    conn.close()
     return game_names
 
 
-def list_game_info(game_name: str) -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Retrieve everything about the game
-    cursor.execute('SELECT * FROM game_watch WHERE game_name = ?', (game_name,))
-    rows = cursor.fetchall()
+def list_game_info(game_name: str) -> List[sqlite3.Row]:
+    """
+    Retrieves everything stored about a game.
 
-    # Get column names
-    column_names = [description[0] for description in cursor.description]
+    Args:
+        game_name (str): The name of the game.
 
-    # Map each row to a dictionary
-    game_info = [dict(zip(column_names, row)) for row in rows]
+    Returns:
+        List[sqlite3.Row]: The matching game watch entries, each row can be read by column name.
+    """
+    conn = _conn()
+    cursor = conn.cursor()
 
-    conn.close()
-    return game_info
+    # Retrieve everything about the game
+    cursor.execute(_SQL_SELECT_INFO_BY_NAME, (game_name,))
+    return cursor.fetchall()
 
 
-def retrieve_all_info() -> List[Dict[str, str]]:
+def retrieve_all_info() -> List[sqlite3.Row]:
     """
     Retrieves all information for each game watch entry.
 
     Returns:
-        List[Dict[str, str]]: A list of dictionaries, each containing all details of a game watch entry.
+        List[sqlite3.Row]: A list of rows, each containing all details of a game watch entry by column name.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    # Retrieve all columns from the game_watch table
-    cursor.execute('SELECT * FROM game_watch')
-    columns = [description[0] for description in cursor.description]  # Get column names
-    game_watches = [dict(zip(columns, row)) for row in cursor.fetchall()]  # Combine column names with row data
+    # Retrieve the user facing columns from the game_watch table
+    cursor.execute(_SQL_SELECT_ALL_INFO)
+    return cursor.fetchall()
 
-    conn.close()
-    return game_watches
+
+def iter_all_info() -> Iterator[sqlite3.Row]:
+    """
+    Like `retrieve_all_info`, but yields the rows straight from the cursor instead of building a list,
+    for callers that only go through them once.
+
+    Returns:
+        Iterator[sqlite3.Row]: The rows of all game watch entries, by column name.
+    """
+    return _conn().cursor().execute(_SQL_SELECT_ALL_INFO)
 
 
 def retrieve_schedule_for_game(game_id: str) -> Optional[str]:
@@ -234,13 +505,12 @@ def retrieve_schedule_for_game(game_id: str) -> Optional[str]:
     Returns:
         Optional[str]: The schedule for the game, or None if the game isn't found.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT cron_schedule FROM game_watch WHERE game_id = ?', (game_id,))
+    cursor.execute(_SQL_SELECT_SCHEDULE, (game_id,))
     result = cursor.fetchone()
 
-    conn.close()
     return result[0] if result else None
 
 
@@ -251,13 +521,10 @@ def delete_game_watch_by_id(game_id: str) -> None:
     Args:
         game_id (str): The unique ID of the game to delete.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM game_watch WHERE game_id = ?', (game_id,))
-
-    conn.commit()
-    conn.close()
+    cursor.execute(_SQL_DELETE_BY_ID, (game_id,))
 
 
 def delete_game_watch_by_name(game_name: str) -> None:
@@ -266,11 +533,9 @@ def delete_game_watch_by_name(game_name: str) -> None:
     :param game_name:
     :return:
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM game_watch WHERE game_name = ?', (game_name,))
-    conn.commit()
-    conn.close()
+    cursor.execute(_SQL_DELETE_BY_NAME, (game_name,))
 
 
 def update_schedule_for_game(game_id: str, new_schedule: str) -> None:
@@ -279,19 +544,14 @@ def update_schedule_for_game(game_id: str, new_schedule: str) -> None:
 
     Args:
         game_id (str): The unique ID of the game.
-        new_schedule (str): The new schedule (e.g., 'weekly', 'daily').
+        new_schedule (str): The new cron schedule (e.g., '0 9 * * 1').
     """
-    conn = sqlite3.connect(DB_FILE)
+    if not _is_valid_schedule(new_schedule):
+        raise ValueError(f"Invalid cron schedule: {new_schedule}")
+    conn = _conn()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        UPDATE game_watch
-        SET cron_schedule = ?
-        WHERE game_id = ?
-    ''', (new_schedule, game_id))
-
-    conn.commit()
-    conn.close()
+    cursor.execute(_SQL_UPDATE_SCHEDULE, (new_schedule, _next_run(new_schedule, _current_hour()), game_id))
 
 
 def retrieve_all_watches() -> List[Tuple[str, str, str, str, str]]:
@@ -301,44 +561,83 @@ def retrieve_all_watches() -> List[Tuple[str, str, str, str, str]]:
     Returns:
         List[Tuple[str, str, str, str, str]]: A list of all game watch entries including game ID, name, type, user, and schedule.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT game_id, game_name, price_watch_type, cron_schedule FROM game_watch')
+    cursor.execute(_SQL_SELECT_ALL_WATCHES)
     watches = cursor.fetchall()
 
-    conn.close()
     return watches
 
 
-def retrieve_current_hour_watches() -> List[Tuple[str, str, str, str, str, str]]:
+def retrieve_current_hour_watches(hour: Optional[datetime] = None) -> List[Tuple[str, str, str, str, float, str]]:
     """
-    Retrieves game watches scheduled for the current hour.
+    Retrieves game watches scheduled for the current hour and moves their next_run past this hour,
+    so every scheduled run is returned once. Runs that were missed in earlier hours are not caught up,
+    but a watch whose stored run is stale is still returned if its schedule fires in this hour.
+
+    Args:
+        hour (Optional[datetime]): The start of the hour to retrieve, defaults to the current hour. Callers
+            that know which hour they run for can pass it, so a run that starts a little late is not missed.
 
     Returns:
-        List[Tuple[str, str, str]]: A list of tuples containing game ID, game name, and watch type for each scheduled game.
+        List[Tuple[str, str, str, str, float, str]]: A list of tuples containing game ID, game name, country,
+        watch type, target value and platform for each scheduled game.
     """
-    current_time = datetime.now()
-    current_hour = current_time.replace(minute=0, second=0, microsecond=0)
-    previous_hour = current_hour - timedelta(hours=1)  # Include the previous hour for matching
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Fetch all entries with their cron schedule
-    cursor.execute('SELECT game_id, game_name, country, price_watch_type, cron_schedule, target_value, platform FROM '
-                   'game_watch')
+    current_hour = hour or _current_hour()
+    next_hour = current_hour + timedelta(hours=1)
+    hour_start, hour_end = int(current_hour.timestamp()), int(next_hour.timestamp())
     games = []
+    next_runs = []
+
+    # Read and reschedule in one transaction, so no other caller gets the same runs
+    with transaction() as conn:
+        cursor = conn.cursor()
+
+        # Only fetch the entries whose next run is before the end of this hour
+        cursor.execute(_SQL_SELECT_DUE, (hour_end,))
 
-    for row in cursor.fetchall():
-        game_id, game_name, country, price_watch_type, cron_schedule, target_value, platform = row
+        for row in cursor:
+            row_id, game_id, game_name, country, price_watch_type, cron_schedule, target_value, platform, next_run = row
 
-        # Use croniter to check if the next or previous run falls within the current hour
-        cron = croniter(cron_schedule, previous_hour)
-        next_run = cron.get_next(datetime)
+            if next_run < hour_start:
+                # Stored for an earlier hour, e.g. added mid-hour or left over from downtime: only that
+                # run is missed, the schedule may still fire within this hour
+                next_run = _next_run(cron_schedule, current_hour)
+            if next_run < hour_end:
+                games.append((game_id, game_name, country, price_watch_type, target_value, platform))
+            next_runs.append((_next_run(cron_schedule, next_hour), row_id))
 
-        # Check if the next or previous run falls within the current hour
-        if next_run.hour == current_hour.hour and next_run.date() == current_hour.date():
-            games.append((game_id, game_name, country, price_watch_type, target_value, platform))
+        cursor.executemany(_SQL_UPDATE_NEXT_RUN, next_runs)
 
-    conn.close()
     return games
+
+
+def cache_get(cache_key: str, max_stale: int = 0) -> Optional[Tuple[str, int]]:
+    """
+    Retrieves a value from the api_cache table.
+
+    Args:
+        cache_key (str): The key the value was stored under.
+        max_stale (int): Also return values that expired at most this many seconds ago.
+
+    Returns:
+        Optional[Tuple[str, int]]: The cached value and the timestamp it expires at, or None if it is missing
+        or expired for longer than `max_stale`.
+    """
+    cursor = _conn().cursor()
+    cursor.execute(_SQL_CACHE_GET, (cache_key, int(time.time()) - max_stale))
+    return cursor.fetchone()
+
+
+def cache_set(cache_key: str, value: str, ttl: int) -> None:
+    """
+    Stores a value in the api_cache table, replacing any previous value for the key.
+
+    Args:
+        cache_key (str): The key to store the value under.
+        value (str): The value, usually a serialized API response.
+        ttl (int): How many seconds the value stays valid.
+    """
+    cursor = _conn().cursor()
+    cursor.execute(_SQL_CACHE_SET, (cache_key, value, int(time.time()) + ttl))
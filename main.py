@@ -1,39 +1,160 @@
-from datetime import datetime
-from typing import List, Dict, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+from functools import lru_cache, partial
+from typing import Callable, List, Dict, NamedTuple, Optional
 
+import aiohttp
 import asyncio
 import discord
 from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
 import logging
-from cron_descriptor import get_description
+from cron_descriptor import FormatError, MissingFieldError, WrongArgumentError, get_description
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
-from api import get_all_time_low_price, get_current_lowest_price, get_game_id, current_best_deal, get_original_price
-from compare import percentage_compare, is_below_target_price, all_time_low_compare
+from api import get_all_time_low_price, get_current_lowest_price, get_game_id, current_best_deal, \
+    parse_best_deals, parse_original_price, parse_all_time_low
+from api_async import create_session, get_prices_many
+from compare import evaluate_watches
 from dbdriver import retrieve_current_hour_watches, add_game_watch, retrieve_all_watches, \
     delete_game_watch_by_name, delete_game_watch_by_id, update_game_watch, retrieve_game_names, \
-    retrieve_all_info, init_db, retrieve_schedule_for_game, list_game_info
+    iter_all_info, init_db, retrieve_schedule_for_game, list_game_info, ALLOWED_PLATFORMS
 
 # Load environment variables
+load_dotenv()
 DB_FILE = os.getenv("DB_FILE")
 TOKEN = os.getenv("DISCORD_TOKEN")
 API_KEY = os.getenv("API_KEY")
 
+# Only used to describe schedules back to users, so each distinct schedule is rendered once
+describe_schedule = lru_cache(maxsize=512)(get_description)
+
 # Set up intents and bot
 intents = discord.Intents.default()
 intents.message_content = True  # Required for reading message content in certain commands
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 
+# Longest message Discord accepts
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def paginate(parts: List[str], separator: str = "\n") -> List[str]:
+    """
+    Joins `parts` with `separator` into as few messages as fit within DISCORD_MESSAGE_LIMIT each.
+    A part that is too long on its own is cut into several messages.
+    """
+    pages: List[str] = []
+    page = ""
+    for part in parts:
+        if page and len(page) + len(separator) + len(part) <= DISCORD_MESSAGE_LIMIT:
+            page += separator + part
+            continue
+        if page:
+            pages.append(page)
+        while len(part) > DISCORD_MESSAGE_LIMIT:
+            pages.append(part[:DISCORD_MESSAGE_LIMIT])
+            part = part[DISCORD_MESSAGE_LIMIT:]
+        page = part
+    if page:
+        pages.append(page)
+    return pages
+
+
+class NotificationBuffer:
+    """
+    Collects notifications for one channel and sends them as a few combined messages instead of one message each,
+    which keeps a busy tick within Discord's per-channel rate limit. Pending notifications are sent at most
+    `max_wait` seconds after the first of them arrived, or when `flush` is called.
+    """
+
+    def __init__(self, channel, max_wait: float = 2.0):
+        self.channel = channel
+        self.max_wait = max_wait
+        self.lines: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def send(self, content) -> None:
+        self.lines.append(str(content))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_wait)
+        await self.flush()
+
+    async def flush(self) -> None:
+        lines, self.lines = self.lines, []
+        task, self._flush_task = self._flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        for message in paginate(lines, "\n\n"):
+            await self.channel.send(message)
+
+
+async def lookup(ctx, func, *args):
+    """
+    Runs a blocking API lookup in a worker thread, so the bot stays responsive, and shows the typing indicator
+    in the channel until the result is in, so slow ITAD responses don't leave the user without feedback.
+    """
+    async with ctx.typing():
+        return await asyncio.to_thread(func, *args)
+
+
+# The bot's game_watch calls run on this one thread, so the event loop never waits on disk and they reuse a
+# single dbdriver connection. The API response cache is not routed here: api and api_async read and write it
+# from their own worker threads, each on its own connection, and those writes can wait on this thread's
+# transactions (and it on theirs) for the connection's busy timeout
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dbdriver")
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a blocking dbdriver call on the database thread and returns its result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+
+def _number_parser(name: str) -> Callable[[Optional[str]], float]:
+    """
+    Returns a parser for a target_value that is required and holds the watch's `name`.
+    """
+    def parse(raw: Optional[str]) -> float:
+        if not raw:
+            raise ValueError(f"A {name} is required as target_value for this watch type.")
+        try:
+            return float(raw)
+        except ValueError:
+            raise ValueError(f"Invalid input: target_value must be a valid number for the {name}.")
+    return parse
+
+
+def _no_target_value(raw: Optional[str]) -> None:
+    """
+    Parser for watch types that take no target_value.
+    """
+    if raw:
+        raise ValueError("'all time low' watch type should not have a target_value.")
+    return None
+
+
+# Parses the raw target_value of add_watch, per watch type
+TARGET_VALUE_PARSERS: Dict[str, Callable[[Optional[str]], Optional[float]]] = {
+    "all time low": _no_target_value,
+    "lower than": _number_parser("max price"),
+    "discount": _number_parser("discount percentage"),
+}
+
+
 # Commands
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
     print("------")
-    init_db()
+    await run_db(init_db)
 
 
 @bot.command(name="add_watch")
@@ -43,35 +164,41 @@ async def add_watch(ctx, game_name: str, country: str, watch_type: str, schedule
     Adds a new game watch.
     Usage: !add_watch <game_name> <country> <watch_type> <schedule> [target_value] [platform]
     """
-    game_id = get_game_id(game_name)
-
-    if game_id is None:
-        await ctx.send("Could not find game with such name.")
+    # Normalize watch_type once and pick the parser of its target_value
+    normalized_watch_type = watch_type.strip().lower()
+    parse_target_value = TARGET_VALUE_PARSERS.get(normalized_watch_type)
+    if parse_target_value is None:
+        await ctx.send("Not a valid watch type. Allowed types are: **all time low**, **lower than**, **discount**.")
         return
-
-    # Convert target_value to float if provided
     try:
-        target_value = float(target_value) if target_value else None
-    except ValueError:
-        await ctx.send("Invalid input: target_value must be a valid number.")
+        target_value = parse_target_value(target_value)
+    except ValueError as e:
+        await ctx.send(str(e))
         return
 
-    # Normalize and validate watch_type
-    normalized_watch_type = watch_type.strip().lower()
-    allowed_watch_types = ['all time low', 'lower than', 'discount']
-    if normalized_watch_type not in allowed_watch_types:
-        await ctx.send("Not a valid watch type. Allowed types are: **all time low**, **lower than**, **discount**.")
+    # Validate platform
+    if platform not in ALLOWED_PLATFORMS:
+        await ctx.send(f"Invalid platform '{platform}'. Allowed platforms are: {', '.join(sorted(ALLOWED_PLATFORMS))}.")
         return
 
-    # Validate platform
-    allowed_platforms = ['Windows', 'MacOS', 'PS5', 'Xbox', 'Switch']
-    if platform not in allowed_platforms:
-        await ctx.send(f"Invalid platform '{platform}'. Allowed platforms are: {', '.join(allowed_platforms)}.")
+    # Describe the schedule before anything is stored, so a schedule the confirmation can't show is rejected
+    # instead of being saved and then failing the command
+    try:
+        schedule_description = describe_schedule(schedule)
+    except (FormatError, MissingFieldError, WrongArgumentError):
+        await ctx.send(f"Invalid cron schedule: {schedule}")
+        return
+
+    # The input is valid, only now look the game up
+    game_id = await lookup(ctx, get_game_id, game_name)
+    if game_id is None:
+        await ctx.send("Could not find game with such name.")
         return
 
     # Add the game watch
     try:
-        add_game_watch(
+        await run_db(
+            add_game_watch,
             game_id=game_id,
             game_name=game_name,
             country=country,
@@ -81,7 +208,7 @@ async def add_watch(ctx, game_name: str, country: str, watch_type: str, schedule
             platform=platform
         )
         await ctx.send(
-            f"Added watch for {game_name} with type '{watch_type}' on {platform} scheduled at {get_description(schedule)}!"
+            f"Added watch for {game_name} with type '{watch_type}' on {platform} scheduled at {schedule_description}!"
         )
     except ValueError as e:
         await ctx.send(str(e))
@@ -97,7 +224,7 @@ async def update_watch(ctx, game_name: str, country: str, watch_type: str = None
     Usage: !update_watch <game_name> <country> <watch_type> <schedule> [target_value] [platform]
     """
     # Fetch the game ID based on game name
-    game_id = get_game_id(game_name)
+    game_id = await lookup(ctx, get_game_id, game_name)
     if game_id is None:
         await ctx.send("Could not find game with such name.")
         return
@@ -110,14 +237,14 @@ async def update_watch(ctx, game_name: str, country: str, watch_type: str = None
         return
 
     # Validate platform if provided
-    allowed_platforms = ['Windows', 'MacOS', 'PS5', 'Xbox', 'Switch']
-    if platform and platform not in allowed_platforms:
-        await ctx.send(f"Invalid platform '{platform}'. Allowed platforms are: {', '.join(allowed_platforms)}.")
+    if platform and platform not in ALLOWED_PLATFORMS:
+        await ctx.send(f"Invalid platform '{platform}'. Allowed platforms are: {', '.join(sorted(ALLOWED_PLATFORMS))}.")
         return
 
     # Call the update function
     try:
-        update_game_watch(
+        await run_db(
+            update_game_watch,
             game_id=game_id,
             game_name=game_name,
             price_watch_type=watch_type,
@@ -139,10 +266,10 @@ async def delete_watch(ctx, identifier: str):
     """
     try:
         if identifier.isdigit():
-            delete_game_watch_by_id(identifier)
+            await run_db(delete_game_watch_by_id, identifier)
             await ctx.send(f"Deleted watch for game ID {identifier}.")
         else:
-            delete_game_watch_by_name(identifier)
+            await run_db(delete_game_watch_by_name, identifier)
             await ctx.send(f"Deleted watch for game name '{identifier}'.")
     except Exception as e:
         await ctx.send(f"Failed to delete watch: {e}")
@@ -155,12 +282,9 @@ async def list_all_game_watched(ctx):
 
     :param ctx: Context of the command
     """
-    game_names = retrieve_game_names()
-    if game_names:
-        response = "\n".join(game_names)
-    else:
-        response = "No games are currently being watched."
-    await ctx.send(response)
+    game_names = await run_db(retrieve_game_names)
+    for page in paginate(game_names) or ["No games are currently being watched."]:
+        await ctx.send(page)
 
 
 @bot.command(name="get_lowest")
@@ -169,7 +293,7 @@ async def get_lowest_now(ctx, name: str, country: str, platform: str):
     Fetch and display the lowest game price from IsThereAnyDeal API for a given game name, country, and platform.
     """
     # Get the current lowest price data
-    price_dict = get_current_lowest_price(name, country, platform)
+    price_dict = await lookup(ctx, get_current_lowest_price, name, country, platform)
 
     # Check if price data exists
     if not price_dict:
@@ -198,7 +322,7 @@ async def get_all_time_low_now(ctx, name: str, country: str):
     :param platform:
     :return:
     """
-    price_dict = get_all_time_low_price(name, country)
+    price_dict = await lookup(ctx, get_all_time_low_price, name, country)
     await ctx.send(f"{price_dict.get('price')} {price_dict.get('currency')}")
 
 
@@ -213,7 +337,7 @@ async def get_best_deal_now(ctx, name: str, country: str, platform: str):
     :return:
     """
     # Fetch the deals
-    deals = current_best_deal(name, country, platform)
+    deals = await lookup(ctx, current_best_deal, name, country, platform)
 
     # Check if deals exist
     if not deals:
@@ -246,22 +370,30 @@ async def list_all_info(ctx):
 
     :param ctx: Context of the command
     """
-    game_information = retrieve_all_info()
-    if game_information:
-        response = "\n\n".join([
-            f"**Game Watch Entry #{info['id']}**\n"
-            f"**Game Name:** {info['game_name']}\n"
-            f"**Watch Type:** {info['price_watch_type'].capitalize()}\n"
-            f"**Schedule:** {info['cron_schedule']}\n"
-            f"**Country:** {info['country']}\n"
-            f"**Max Price:** {info.get('max_price', 'N/A')}\n"
-            f"**Discount Percentage:** {info.get('discount_percentage', 'N/A')}\n"
-            f"------------------------"
-            for info in game_information
-        ])
-    else:
-        response = "No game watch entries found."
-    await ctx.send(response)
+    for page in await run_db(format_all_info):
+        await ctx.send(page)
+
+
+def format_all_info() -> List[str]:
+    """
+    Formats every game watch entry for `list_all`, as pages that each fit in one message.
+    """
+    # Rows are formatted as they come off the cursor, then packed into as few messages as fit
+    return paginate([
+        f"**Game Watch Entry #{info['id']}**\n"
+        f"**Game Name:** {info['game_name']}\n"
+        f"**Watch Type:** {info['price_watch_type'].capitalize()}\n"
+        f"**Schedule:** {info['cron_schedule']}\n"
+        f"**Country:** {info['country']}\n"
+        f"**Max Price:** {info['target_value'] if info['price_watch_type'] == 'lower than' else 'N/A'}\n"
+        f"**Discount Percentage:** {info['target_value'] if info['price_watch_type'] == 'discount' else 'N/A'}\n"
+        f"------------------------"
+        for info in iter_all_info()
+    ], "\n\n") or ["No game watch entries found."]
+
+
+# Pages of the show_commands reply, built on its first call
+help_pages: Optional[List[str]] = None
 
 
 @bot.command(name="show_commands")
@@ -271,12 +403,15 @@ async def show_commands(ctx):
 
     Usage: !show_commands
     """
-    response = "**Available Commands:**\n\n"
-
-    for command in bot.commands:
-        response += f"**!{command.name}** - {command.help}\n\n"
+    # Commands are all registered at import, so the text is built on first use and reused afterwards
+    global help_pages
+    if help_pages is None:
+        response = "**Available Commands:**\n\n" + "".join(
+            f"**!{command.name}** - {command.help}\n\n" for command in bot.commands)
+        help_pages = paginate([response])
 
-    await ctx.send(response)
+    for page in help_pages:
+        await ctx.send(page)
 
 
 @bot.command(name="get_schedule")
@@ -285,7 +420,7 @@ async def get_schedule(ctx, game_id: str):
     Retrieves and displays the schedule for a specific game.
     Usage: !get_schedule <game_id>
     """
-    schedule = retrieve_schedule_for_game(game_id)
+    schedule = await run_db(retrieve_schedule_for_game, game_id)
     if schedule:
         await ctx.send(f"The schedule for game ID {game_id} is: {schedule}")
     else:
@@ -298,11 +433,11 @@ async def game_info(ctx, game_name: str):
     Retrieves and displays all information about a specific game.
     Usage: !game_info <game_name>
     """
-    info = list_game_info(game_name)
+    info = await run_db(list_game_info, game_name)
     if info:
         # Format and send each game's info in a readable format
         for game in info:
-            details = "\n".join([f"**{key}**: {value}" for key, value in game.items()])
+            details = "\n".join(f"**{key}**: {game[key]}" for key in game.keys())
             await ctx.send(f"**Game Information for {game_name}**:\n{details}")
     else:
         await ctx.send(f"No information found for game '{game_name}'.")
@@ -310,57 +445,150 @@ async def game_info(ctx, game_name: str):
 
 @bot.command(name="start_watch")
 async def start_check_price_watches(ctx):
-    # Calculate the delay to the next full hour
-    now = datetime.now()
-    delay = (60 - now.minute) * 60 - now.second  # Delay until the next full hour
-
-    await asyncio.sleep(delay)
+    # The loop waits for the next full hour by itself
     check_price_watches.start(ctx)
 
 
-@tasks.loop(hours=1)
+# Session shared by every run of check_price_watches, open while the loop is running
+itad_session: Optional[aiohttp.ClientSession] = None
+
+
+# Every full hour in local time, the hours next_run is bucketed by. Fixed times keep the loop on the hour
+# boundary for good, where an interval would start from whenever start_watch was called
+FULL_HOURS = [time(hour=hour, tzinfo=datetime.now().astimezone().tzinfo) for hour in range(24)]
+
+
+class PriceCheck(NamedTuple):
+    """
+    A due watch together with the price points it is evaluated and notified with.
+    """
+    game_id: str
+    game_name: str
+    country: str
+    watch_type: str
+    target_value: Optional[float]
+    platform: str
+    currency: Optional[str]
+    current_price: float
+    original_price: float
+    all_time_low: Optional[float]
+
+
+@tasks.loop(time=FULL_HOURS)
 async def check_price_watches(ctx):
     """
     Periodically checks for watches scheduled for the current hour.
     """
-    current_hour_watches = retrieve_current_hour_watches()
+    current_hour_watches = await run_db(retrieve_current_hour_watches)
+
+    # Countries are checked concurrently, and each one notifies as soon as its own prices are in.
+    # Notifications arriving close together are combined into one message
+    notifications = NotificationBuffer(ctx)
+    watches_by_country: Dict[str, List[tuple]] = defaultdict(list)
+    for watch in current_hour_watches:
+        watches_by_country[watch[2]].append(watch)
+    await asyncio.gather(*[check_country_watches(notifications, country, watches)
+                           for country, watches in watches_by_country.items()])
+    await notifications.flush()
+
 
-    for game_id, game_name, country, watch_type, target_value, platform in current_hour_watches:
+async def check_country_watches(notifications: NotificationBuffer, country: str, watches: List[tuple]):
+    """
+    Fetches the prices of the due watches of one country in bulk, then evaluates and notifies them.
+    """
+    try:
+        prices = await get_prices_many([watch[0] for watch in watches], country, itad_session)
+    except Exception as e:
+        logging.error("Error fetching prices for country %s: %s", country, e)
+        return
+
+    # Gather the price points of every watch, then evaluate them all in one batch
+    checks = []
+    for game_id, game_name, country, watch_type, target_value, platform in watches:
         try:
-            # Get the current lowest price
-            current_price_data = get_current_lowest_price(game_id, country, platform).get("current_price")
-            currency = current_price_data.get("currency")
-            current_price = current_price_data.get("current_price")
-            original_price = get_original_price(game_name, country, platform).get("original_price")
+            game_data = prices.get(game_id)
+            if game_data is None:
+                raise ValueError("Can't find price data")
 
-            if not current_price:
-                print(f"No current prices found for {game_name}.")
+            # Get the current lowest price
+            best_deals = parse_best_deals(game_data, platform)
+            if not best_deals:
+                logging.debug("No current prices found for %s.", game_name)
                 raise ValueError("Can't find current prices")
+            currency = best_deals[0].get("currency")
+            current_price = best_deals[0].get("current_price")
+            original_price = parse_original_price(game_data).get("original_price")
+
             if not original_price:
                 raise ValueError("Can't find original price")
 
-            # Determine action based on watch_type
+            all_time_low = None
             if watch_type == "all time low":
-                all_time_low = get_all_time_low_price(game_id, country).get("price")
-                if all_time_low and all_time_low_compare(current_price, all_time_low):
-                    print(
-                        f"{game_name} is at its all-time low price of {all_time_low} {currency}!")
-                    print(get_lowest_now(game_id, country))
-
-            elif watch_type == "discount":
-                if percentage_compare(current_price, original_price, target_value):
-                    await ctx.send(
-                        f"{game_name} is available at a {target_value}% discount! Current price: {current_price}.")
-                    await ctx.send(get_best_deal_now(game_name, country, platform))
-
-            elif watch_type == "lower than":
-                if target_value and is_below_target_price(current_price, target_value):
-                    await ctx.send(
-                        f"{game_name} is now below your target price of {target_value}. Current price: {current_price}.")
-                    await ctx.send(get_lowest_now(game_id, country))
+                all_time_low = parse_all_time_low(game_data, country).get("price")
 
+            checks.append(PriceCheck(game_id=game_id, game_name=game_name, country=country, watch_type=watch_type,
+                                     target_value=target_value, platform=platform, currency=currency,
+                                     current_price=current_price, original_price=original_price,
+                                     all_time_low=all_time_low))
         except Exception as e:
-            print(f"Error checking price for {game_name}: {e}")
+            logging.error("Error checking price for %s: %s", game_name, e)
+
+    # Evaluate them in one batch from the parallel columns evaluate_watches takes
+    triggered = evaluate_watches([check.watch_type for check in checks],
+                                 [check.current_price for check in checks],
+                                 [check.original_price for check in checks],
+                                 [check.target_value for check in checks],
+                                 [check.all_time_low for check in checks])
+
+    # Notifications only queue up in the buffer, which sends them combined, so they are added one by one
+    for check, is_triggered in zip(checks, triggered):
+        if is_triggered:
+            await notify_watch(notifications, check)
+
+
+@check_price_watches.before_loop
+async def open_itad_session():
+    """
+    Opens the session the watch loop sends its IsThereAnyDeal requests through.
+    """
+    global itad_session
+    itad_session = create_session()
+
+
+@check_price_watches.after_loop
+async def close_itad_session():
+    """
+    Closes the watch loop's session once the loop stops.
+    """
+    global itad_session
+    if itad_session is not None:
+        await itad_session.close()
+        itad_session = None
+
+
+async def notify_watch(notifications: NotificationBuffer, check: PriceCheck):
+    """
+    Queues the notification of a single triggered watch, as built by `check_country_watches`.
+    """
+    game_name, currency, current_price = check.game_name, check.currency, check.current_price
+    # The prices were fetched for the check already, so the details are formatted from them
+    details = (f"{game_name} ({check.country}, {check.platform}): {current_price} {currency} "
+               f"(was {check.original_price} {currency})")
+
+    # Determine action based on watch_type
+    if check.watch_type == "all time low":
+        await notifications.send(
+            f"{game_name} is at its all-time low price of {check.all_time_low} {currency}!\n{details}")
+
+    elif check.watch_type == "discount":
+        await notifications.send(
+            f"{game_name} is available at a {check.target_value}% discount! Current price: {current_price}.\n"
+            f"{details}")
+
+    elif check.watch_type == "lower than":
+        await notifications.send(
+            f"{game_name} is now below your target price of {check.target_value}. Current price: {current_price}.\n"
+            f"{details}")
 
 
 # Error handler for commands
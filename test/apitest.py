@@ -0,0 +1,95 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+# api refuses to load without a key, the session is stubbed so it is never sent
+os.environ.setdefault("API_KEY", "test")
+import api  # noqa: E402
+import dbdriver  # noqa: E402
+
+# A named in-memory database of its own, so it doesn't share state with the dbdriver tests
+DB_FILE = "file:gamescout_api_test?mode=memory&cache=shared"
+URL = "https://api.isthereanydeal.com/test/v1"
+
+
+class TestResponseCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Point dbdriver at the test database, which provides the api_cache table.
+        """
+        dbdriver.configure(DB_FILE)
+        dbdriver.init_db()
+        cls.conn = dbdriver._conn()
+        cls.cache_key = api.response_cache_key("GET", URL, {}, None)
+
+    def setUp(self):
+        """
+        Starts every test with an empty cache and a stubbed session, so no request leaves the process.
+        """
+        # Background refreshes write from their own connection, so the cache is emptied rather than
+        # rolled back through a savepoint
+        self.conn.execute("DELETE FROM api_cache")
+        patcher = mock.patch.object(api._SESSION, "request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Runs after all tests have completed, closing the last connection discards the in-memory test database.
+        """
+        dbdriver.close_connection()
+
+    def _respond(self, text: str) -> None:
+        """
+        Makes the stubbed session answer every request with a 200 response holding `text`.
+        """
+        self.request.return_value = mock.Mock(status_code=200, text=text, content=text.encode())
+
+    def _wait_for_refresh(self) -> None:
+        """
+        Waits until the background refresh of the test entry has finished.
+        """
+        deadline = time.monotonic() + 5
+        while self.request.call_count == 0 or self.cache_key in api._refreshing:
+            self.assertLess(time.monotonic(), deadline, "background refresh did not finish")
+            time.sleep(0.01)
+
+    def test_fresh_response_is_cached(self):
+        """Test that a response is stored and a second request within its ttl is answered from the cache."""
+        self._respond('{"value": 1}')
+        self.assertEqual(api._request_json("GET", URL, {}, None, 60), {"value": 1})
+        self.assertEqual(api._request_json("GET", URL, {}, None, 60), {"value": 1})
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_stale_while_revalidate(self):
+        """Test that a recently expired response is returned right away and refreshed in the background."""
+        dbdriver.cache_set(self.cache_key, '{"value": "old"}', -1)
+        self._respond('{"value": "new"}')
+
+        self.assertEqual(api._request_json("GET", URL, {}, None, 60), {"value": "old"})
+        self._wait_for_refresh()
+        self.assertEqual(dbdriver.cache_get(self.cache_key)[0], '{"value": "new"}')
+
+    def test_stale_if_error(self):
+        """Test that an expired response is returned when the API can't be reached."""
+        dbdriver.cache_set(self.cache_key, '{"value": "old"}', -(api.STALE_WHILE_REVALIDATE + 60))
+        self.request.side_effect = requests.ConnectionError("offline")
+
+        self.assertEqual(api._request_json("GET", URL, {}, None, 60), {"value": "old"})
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_error_without_cached_response(self):
+        """Test that a failing request is raised when nothing is cached."""
+        self.request.side_effect = requests.ConnectionError("offline")
+        with self.assertRaises(requests.ConnectionError):
+            api._request_json("GET", URL, {}, None, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from compare import evaluate_watches
+
+
+class TestEvaluateWatches(unittest.TestCase):
+
+    def evaluate(self, watch_type, current_price, original_price=40.0, target_value=None, all_time_low=None):
+        """
+        Evaluates a single watch and returns whether it is met.
+        """
+        return evaluate_watches([watch_type], [current_price], [original_price], [target_value], [all_time_low])[0]
+
+    def test_all_time_low(self):
+        """Test that an 'all time low' watch is met at or below the all-time low price."""
+        self.assertTrue(self.evaluate("all time low", 10.0, all_time_low=10.0))
+        self.assertTrue(self.evaluate("all time low", 9.0, all_time_low=10.0))
+        self.assertFalse(self.evaluate("all time low", 11.0, all_time_low=10.0))
+        self.assertFalse(self.evaluate("all time low", 10.0, all_time_low=None))
+
+    def test_discount(self):
+        """Test that a 'discount' watch is met once the price is at least target_value percent off."""
+        self.assertTrue(self.evaluate("discount", 20.0, target_value=50))
+        self.assertTrue(self.evaluate("discount", 10.0, target_value=50))
+        self.assertFalse(self.evaluate("discount", 30.0, target_value=50))
+        self.assertFalse(self.evaluate("discount", 10.0, target_value=None))
+
+    def test_lower_than(self):
+        """Test that a 'lower than' watch is met at or below its target price."""
+        self.assertTrue(self.evaluate("lower than", 20.0, target_value=20.0))
+        self.assertTrue(self.evaluate("lower than", 15.0, target_value=20.0))
+        self.assertFalse(self.evaluate("lower than", 25.0, target_value=20.0))
+        self.assertFalse(self.evaluate("lower than", 15.0, target_value=None))
+
+    def test_missing_current_price(self):
+        """Test that a watch without a current price is never met."""
+        for watch_type in ("all time low", "discount", "lower than"):
+            with self.subTest(watch_type=watch_type):
+                self.assertFalse(self.evaluate(watch_type, None, target_value=50, all_time_low=10.0))
+
+    def test_unknown_watch_type(self):
+        """Test that an unknown watch type is never met."""
+        self.assertFalse(self.evaluate("price increase", 1.0, target_value=100, all_time_low=100.0))
+
+    def test_batch(self):
+        """Test that a batch returns one result per watch, in order."""
+        self.assertEqual(
+            evaluate_watches(["lower than", "discount", "all time low"], [15.0, 30.0, 5.0], [40.0, 40.0, 40.0],
+                             [20.0, 50, None], [None, None, 5.0]),
+            [True, False, True])
+        self.assertEqual(evaluate_watches([], [], [], [], []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
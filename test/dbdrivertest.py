@@ -1,107 +1,140 @@
-import importlib
 import unittest
-import sqlite3
-import os
 from datetime import datetime
 
 import dbdriver
-from dbdriver import (  # Replace `your_module` with the actual module name where your functions are located
-    init_db, add_game_watch, update_game_watch, retrieve_game_names,
-    list_game_info, retrieve_all_info, retrieve_schedule_for_game,
-    delete_game_watch_by_id, delete_game_watch_by_name,
-    update_schedule_for_game, retrieve_all_watches, retrieve_current_hour_watches
+from dbdriver import (
+    configure, init_db, close_connection, transaction, add_game_watch, add_game_watches_bulk, update_game_watch,
+    retrieve_game_names, list_game_info, retrieve_all_info, iter_all_info, retrieve_schedule_for_game,
+    delete_game_watch_by_id, delete_game_watch_by_name, update_schedule_for_game, retrieve_all_watches,
+    retrieve_current_hour_watches
 )
 
-DB_FILE = "test_db.sqlite"
+# A named in-memory database, it lives as long as dbdriver's connection to it is open. Shared-cache memory
+# databases are private to their process, so parallel runs (e.g. `pytest -n auto` with pytest-xdist) give
+# every worker its own copy
+DB_FILE = "file:gamescout_test?mode=memory&cache=shared"
+
+# The hour the scheduling tests run for: a Monday at 9:00, when the shared watch's schedule fires
+WATCH_HOUR = datetime(2030, 1, 7, 9)
 
 
 class TestDatabaseFunctions(unittest.TestCase):
+    game_id = "4343431"
+    game_name = "Test Game2"
+    price_watch_type = "lower than"
+    schedule = "0 9 * * 1"
+    country = "US"
+    target_value = 20.00
+    # The arguments the shared watch is added with
+    base_watch = dict(game_id=game_id, game_name=game_name, price_watch_type=price_watch_type, schedule=schedule,
+                      country=country, target_value=target_value)
 
     @classmethod
     def setUpClass(cls):
         """
         Set up the environment and initialize the test database before all tests.
         """
-        # Set the environment variable for DB_FILE to point to the test database
-        os.environ["DB_FILE"] = DB_FILE
-        # Reload the dbdriver module to use the updated environment variable
-        importlib.reload(dbdriver)
+        # Point dbdriver at the test database
+        configure(DB_FILE)
+
+        # Initialize the test database and add the watch most tests work on, every test starts out with it
+        init_db()
+        cls.watch_id = add_game_watch(**cls.base_watch)
 
-        # Initialize the test database
-        dbdriver.init_db()
+        # Results are checked on dbdriver's own connection, so they include what a test has not committed.
+        # It is already tuned by dbdriver (synchronous=NORMAL, temp_store=MEMORY, mmap) and the in-memory
+        # database never syncs to disk, so no further PRAGMAs are needed here
+        cls.conn = dbdriver._conn()
 
     def setUp(self):
         """
-        Runs before each test case to establish database connection and set test data.
+        Runs before each test case to open a savepoint.
         """
-        self.conn = sqlite3.connect(DB_FILE)
-        self.cursor = self.conn.cursor()
-        self.game_id = "4343431"
-        self.game_name = "Test Game2"
-        self.price_watch_type = "lower than"
-        self.schedule = "0 9 * * 1"
-        self.country = "US"
-        self.target_value = 20.00
-        self.discount_percentage = None
+        # Everything a test writes happens inside this savepoint and is rolled back afterwards
+        self.conn.execute("SAVEPOINT test_case")
 
     def tearDown(self):
-        """Clean up the database after each test case."""
-        self.cursor.execute("DELETE FROM game_watch")
-        self.conn.commit()
-        self.conn.close()
-        self.conn = None  # Set to None to ensure it's not left open
+        """Clean up the database after each test case by rolling back its savepoint."""
+        self.conn.execute("ROLLBACK TO test_case")
+        self.conn.execute("RELEASE test_case")
 
     @classmethod
     def tearDownClass(cls):
         """
-        Runs after all tests have completed to delete the test database file.
+        Runs after all tests have completed, closing the last connection discards the in-memory test database.
         """
-        if hasattr(cls, 'conn') and cls.conn:
-            cls.conn.close()
+        close_connection()
 
-        # Delete the test database file if it exists
-        if os.path.exists(DB_FILE):
-            try:
-                os.remove(DB_FILE)
-            except PermissionError:
-                print(f"Failed to delete {DB_FILE}. Please ensure no other processes are using it.")
+    def _bulk_add(self, count: int) -> list:
+        """
+        Adds `count` watches named "Bulk Game <n>" in one transaction and returns their rows. Tests that need
+        many rows should use this rather than calling add_game_watch in a loop, it sends chunked multi-row
+        INSERTs instead of one statement per row.
+        """
+        rows = [
+            (f"id{i}", f"Bulk Game {i}", self.price_watch_type, self.schedule, self.country, self.target_value,
+             "Windows")
+            for i in range(count)
+        ]
+        add_game_watches_bulk(rows)
+        return rows
 
     def test_add_game_watch(self):
         """
         Test adding a game watch entry to the database.
         """
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
-        self.cursor.execute("SELECT * FROM game_watch WHERE game_name = ?", (self.game_name,))
-        result1 = self.cursor.fetchone()
-        self.assertIsNotNone(result1)
-        self.assertEqual(result1[2], self.game_name)
+        new_id = add_game_watch(**{**self.base_watch, "game_id": "4343432", "game_name": "Test Game3"})
+        self.assertNotEqual(new_id, self.watch_id)
+        result1 = list_game_info("Test Game3")
+        self.assertEqual(len(result1), 1)
+        self.assertEqual(result1[0]["id"], new_id)
+        self.assertEqual(result1[0]["game_name"], "Test Game3")
 
-    def test_update_game_watch(self):
-        """Test updating a game watch entry in the database."""
-        # Add the initial game watch entry
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
+    def test_add_duplicate_game_watch(self):
+        """Test that adding a second watch for the same game name is rejected."""
+        with self.assertRaises(FileExistsError):
+            add_game_watch(**self.base_watch)
+
+    def test_add_game_watch_rejects_non_standard_schedules(self):
+        """Test that cron aliases and 6-field schedules, which the bot can't describe as they run, are rejected."""
+        for schedule in ("@daily", "0 0 9 * * 1"):
+            with self.subTest(schedule=schedule), self.assertRaises(ValueError):
+                add_game_watch(**{**self.base_watch, "game_name": "Test Game3", "schedule": schedule})
+        self.assertEqual(list_game_info("Test Game3"), [])
 
-        # Retrieve the ID directly after insertion
-        self.cursor.execute("SELECT game_id FROM game_watch WHERE game_name = ?", (self.game_name,))
-        game_id = self.cursor.fetchone()[0]
+    def test_update_missing_game_watch(self):
+        """Test that updating a game watch that doesn't exist raises FileNotFoundError."""
+        with self.assertRaises(FileNotFoundError):
+            update_game_watch(game_id="missing", game_name="Updated Game")
+        with self.assertRaises(FileNotFoundError):
+            update_game_watch(game_id="missing")
 
-        # Print initial data for verification
-        print("Before update:", list_game_info(self.game_name))
-        print("Game ID:", game_id)
+    def test_add_game_watches_bulk(self):
+        """Test adding several game watches at once, and that a failing batch adds nothing."""
+        rows = self._bulk_add(250)  # Spans full chunks and a partial one
+        self.assertEqual(len(retrieve_all_watches()), 251)  # The bulk rows and the shared watch
+
+        # A duplicate name rolls back the whole batch
+        with self.assertRaises(FileExistsError):
+            add_game_watches_bulk([("new", "New Game", "all time low", self.schedule, "US", None, "Windows"),
+                                   rows[0]])
+        self.assertEqual(list_game_info("New Game"), [])
+
+    def test_transaction_rollback(self):
+        """Test that a failing transaction block leaves the database untouched."""
+        with self.assertRaises(RuntimeError):
+            with transaction():
+                add_game_watch("4343432", "Test Game3", self.price_watch_type, self.schedule,
+                               self.country, self.target_value)
+                delete_game_watch_by_name(self.game_name)
+                raise RuntimeError("abort")
+        self.assertEqual(list_game_info("Test Game3"), [])
+        self.assertTrue(list_game_info(self.game_name))
+
+    def test_update_game_watch(self):
+        """Test updating a game watch entry in the database."""
+        # Retrieve the ID of the shared watch
+        game_id = list_game_info(self.game_name)[0]["game_id"]
 
         # Perform the update using the retrieved ID
         update_game_watch(
@@ -111,10 +144,6 @@ class TestDatabaseFunctions(unittest.TestCase):
             country="US",
         )
 
-        # Print updated data for verification
-        print("After update (original name):", list_game_info(self.game_name))
-        print("After update (updated name):", list_game_info("Updated Game"))
-
         # Verify the update by checking for the updated name
         updated_info = list_game_info("Updated Game")
         self.assertTrue(updated_info)  # Check that the game exists
@@ -124,94 +153,41 @@ class TestDatabaseFunctions(unittest.TestCase):
 
     def test_retrieve_game_names(self):
         """Test retrieving unique game names."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         game_names = retrieve_game_names()
         self.assertIn(self.game_name, game_names)
 
     def test_list_game_info(self):
         """Test listing all information for a game."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         game_info = list_game_info(self.game_name)
         self.assertEqual(game_info[0]["game_name"], self.game_name)
 
     def test_retrieve_all_info(self):
         """Test retrieving all game watch entries."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         all_info = retrieve_all_info()
         self.assertGreater(len(all_info), 0)
+        self.assertEqual(all_info[0].keys(), ["id", "game_id", "game_name", "price_watch_type", "cron_schedule",
+                                              "country", "target_value", "platform"])
+        self.assertEqual([tuple(row) for row in iter_all_info()], [tuple(row) for row in all_info])
 
     def test_retrieve_schedule_for_game(self):
         """Test retrieving the schedule for a specific game."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         retrieved_schedule = retrieve_schedule_for_game(self.game_id)
         self.assertEqual(retrieved_schedule, self.schedule)
 
     def test_delete_game_watch_by_id(self):
         """Test deleting a game watch by game ID."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         delete_game_watch_by_id(self.game_id)
         result = list_game_info(self.game_name)
         self.assertEqual(result, [])
 
     def test_delete_game_watch_by_name(self):
         """Test deleting a game watch by game name."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         delete_game_watch_by_name(self.game_name)
         result = list_game_info(self.game_name)
         self.assertEqual(result, [])
 
     def test_update_schedule_for_game(self):
         """Test updating the schedule for a game."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         new_schedule = "0 10 * * 2"
         update_schedule_for_game(self.game_id, new_schedule)
         updated_schedule = retrieve_schedule_for_game(self.game_id)
@@ -219,37 +195,99 @@ class TestDatabaseFunctions(unittest.TestCase):
 
     def test_retrieve_all_watches(self):
         """Test retrieving all game watches."""
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
         all_watches = retrieve_all_watches()
         self.assertGreater(len(all_watches), 0)
 
+    def _schedule_from(self, start: datetime) -> None:
+        """
+        Recomputes the next run of every watch as if they had been scheduled at `start`, so tests that check
+        the scheduled hours don't depend on the wall clock.
+        """
+        rows = self.conn.execute("SELECT id, cron_schedule FROM game_watch").fetchall()
+        self.conn.executemany("UPDATE game_watch SET next_run = ? WHERE id = ?",
+                              [(dbdriver._next_run(schedule, start), row_id) for row_id, schedule in rows])
+
     def test_retrieve_current_hour_watches(self):
         """Test retrieving watches for the current hour."""
-        # Convert the current time to a cron expression for the current hour
-        current_hour = datetime.now().hour
-        self.schedule = f"0 {current_hour} * * *"  # Every day at the current hour
-
-        # Add the game watch entry with the cron schedule for the current hour
-        dbdriver.add_game_watch(
-            game_id=self.game_id,
-            game_name=self.game_name,
-            price_watch_type=self.price_watch_type,
-            schedule=self.schedule,
-            country=self.country,
-            target_value=self.target_value,
-        )
+        self._schedule_from(WATCH_HOUR)
+
+        current_hour_watches = retrieve_current_hour_watches(WATCH_HOUR)
+        self.assertEqual(current_hour_watches, [(self.game_id, self.game_name, self.country, self.price_watch_type,
+                                                 self.target_value, "Windows")])
+
+    def test_retrieve_current_hour_watches_only_once(self):
+        """Test that a scheduled run is only returned once and other hours are skipped."""
+        update_schedule_for_game(self.game_id, "0 9 * * *")
+        add_game_watch("4343432", "Test Game3", self.price_watch_type, "0 11 * * *", self.country,
+                       self.target_value)
+        self._schedule_from(WATCH_HOUR)
+
+        current_hour_watches = retrieve_current_hour_watches(WATCH_HOUR)
+        self.assertEqual([watch[0] for watch in current_hour_watches], [self.game_id])
+
+        # The run has been consumed, so asking again in the same hour returns nothing
+        self.assertEqual(retrieve_current_hour_watches(WATCH_HOUR), [])
+
+    def test_retrieve_current_hour_watches_stale_next_run(self):
+        """Test that a watch whose stored run is from an earlier hour still gets its run in this hour."""
+        update_schedule_for_game(self.game_id, "0 * * * *")
+        hour_start = int(WATCH_HOUR.timestamp())
+        self.conn.execute("UPDATE game_watch SET next_run = ? WHERE game_id = ?", (hour_start - 7200, self.game_id))
+
+        self.assertEqual([watch[0] for watch in retrieve_current_hour_watches(WATCH_HOUR)], [self.game_id])
+        next_run = self.conn.execute("SELECT next_run FROM game_watch WHERE game_id = ?", (self.game_id,)).fetchone()[0]
+        self.assertEqual(next_run, hour_start + 3600)
+
+    def test_retrieve_current_hour_watches_skips_missed_runs(self):
+        """Test that a missed run is not caught up when the schedule doesn't fire in this hour."""
+        update_schedule_for_game(self.game_id, "0 11 * * *")
+        hour_start = int(WATCH_HOUR.timestamp())
+        self.conn.execute("UPDATE game_watch SET next_run = ? WHERE game_id = ?", (hour_start - 7200, self.game_id))
+
+        self.assertEqual(retrieve_current_hour_watches(WATCH_HOUR), [])
+        next_run = self.conn.execute("SELECT next_run FROM game_watch WHERE game_id = ?", (self.game_id,)).fetchone()[0]
+        self.assertEqual(next_run, hour_start + 7200)  # 11:00 the same day
+
+
+class TestInitDbMigrations(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Points dbdriver at a database of its own that was created before game names had to be unique.
+        """
+        configure("file:gamescout_migration_test?mode=memory&cache=shared")
+        self.conn = dbdriver._conn()
+        self.conn.executescript('''
+            CREATE TABLE game_watch (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id TEXT NOT NULL,
+            game_name TEXT NOT NULL,
+            price_watch_type TEXT NOT NULL,
+            cron_schedule TEXT NOT NULL,
+            country TEXT NOT NULL DEFAULT "US",
+            target_value REAL DEFAULT NULL,
+            platform TEXT
+            );
+        ''')
+
+    def tearDown(self):
+        """Closing the connection discards the migration test database."""
+        close_connection()
+
+    def test_init_db_removes_duplicate_game_names(self):
+        """Test that init_db keeps the oldest watch of a duplicated game name and then enforces unique names."""
+        self.conn.executemany(
+            "INSERT INTO game_watch (game_id, game_name, price_watch_type, cron_schedule) VALUES (?, ?, ?, ?)",
+            [("1", "Dup Game", "all time low", "0 9 * * 1"), ("2", "Other Game", "all time low", "0 9 * * 1"),
+             ("1", "Dup Game", "all time low", "0 10 * * 1")])
+
+        with self.assertLogs(level="WARNING"):
+            init_db()
 
-        # Retrieve watches scheduled for the current hour
-        current_hour_watches = retrieve_current_hour_watches()
-        print(current_hour_watches)  # For debugging
-        self.assertGreater(len(current_hour_watches), 0)
+        self.assertEqual([(row["game_name"], row["cron_schedule"]) for row in retrieve_all_info()],
+                         [("Dup Game", "0 9 * * 1"), ("Other Game", "0 9 * * 1")])
+        with self.assertRaises(FileExistsError):
+            add_game_watch("1", "Dup Game", "all time low", "0 9 * * 1")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+# api refuses to load without a key, nothing in these tests talks to the API or to Discord
+os.environ.setdefault("API_KEY", "test")
+import main  # noqa: E402
+
+
+class TestPaginate(unittest.TestCase):
+
+    def test_exact_limit(self):
+        """Test that parts filling DISCORD_MESSAGE_LIMIT exactly stay in one message, one more character doesn't."""
+        limit = main.DISCORD_MESSAGE_LIMIT
+        self.assertEqual(main.paginate(["a" * limit]), ["a" * limit])
+        self.assertEqual(main.paginate(["a" * 999, "b" * (limit - 1000)]), ["a" * 999 + "\n" + "b" * (limit - 1000)])
+        self.assertEqual(main.paginate(["a" * 1000, "b" * (limit - 1000)]), ["a" * 1000, "b" * (limit - 1000)])
+
+    def test_oversized_line(self):
+        """Test that a part longer than DISCORD_MESSAGE_LIMIT is cut into several messages."""
+        limit = main.DISCORD_MESSAGE_LIMIT
+        pages = main.paginate(["short", "x" * (2 * limit + 500), "tail"])
+        self.assertEqual(pages, ["short", "x" * limit, "x" * limit, "x" * 500 + "\n" + "tail"])
+
+
+class TestNotificationBuffer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        Stubs the channel the buffer sends to.
+        """
+        self.channel = mock.Mock()
+        self.channel.send = mock.AsyncMock()
+
+    def _sent(self) -> list:
+        """
+        Returns the messages sent to the channel so far.
+        """
+        return [call.args[0] for call in self.channel.send.await_args_list]
+
+    async def test_flush_sends_several_messages(self):
+        """Test that a flush combines the notifications into as few messages as fit the limit."""
+        buffer = main.NotificationBuffer(self.channel, max_wait=60)
+        lines = [f"{i}" * 600 for i in range(5)]
+        for line in lines:
+            await buffer.send(line)
+        self.channel.send.assert_not_awaited()
+
+        await buffer.flush()
+        sent = self._sent()
+        self.assertEqual(len(sent), 2)
+        self.assertTrue(all(len(message) <= main.DISCORD_MESSAGE_LIMIT for message in sent))
+        self.assertEqual("\n\n".join(sent), "\n\n".join(lines))
+
+        # Nothing is left to send afterwards
+        await buffer.flush()
+        self.assertEqual(len(self._sent()), 2)
+
+    async def test_sends_after_max_wait(self):
+        """Test that pending notifications are sent on their own once max_wait has passed."""
+        buffer = main.NotificationBuffer(self.channel, max_wait=0.01)
+        await buffer.send("first")
+        await buffer.send("second")
+        await asyncio.sleep(0.05)
+        self.assertEqual(self._sent(), ["first\n\nsecond"])
+
+
+class TestAddWatch(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        Stubs the command context and everything add_watch would look up or store.
+        """
+        self.ctx = mock.Mock()
+        self.ctx.send = mock.AsyncMock()
+        for name in ("lookup", "run_db"):
+            patcher = mock.patch.object(main, name, new=mock.AsyncMock())
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    async def test_schedule_that_cannot_be_described(self):
+        """Test that a schedule the confirmation can't describe is rejected before anything is stored."""
+        await main.add_watch.callback(self.ctx, "Some Game", "US", "all time low", "@daily")
+        self.ctx.send.assert_awaited_once_with("Invalid cron schedule: @daily")
+        self.lookup.assert_not_awaited()
+        self.run_db.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()